@@ -6,8 +6,9 @@ from fastapi import Depends, Request
 from services.auth import get_current_user
 from typing import Optional
 from sqlalchemy import select, func
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, undefer
 from database import SessionLocal
+from services.db_routing import read_session
 import json
 from utils.token_utils import SECRET_KEY, verify_access_token  # Import verify_access_token
 
@@ -208,6 +209,10 @@ class CompanyReportAdmin(ModelView, model=CompanyReport):
         'user',
         'company_info'
     ]
+
+    def details_query(self, request: Request):
+        # report_data is deferred with raiseload, only the details page shows it
+        return super().details_query(request).options(undefer(CompanyReport.report_data))
     
 class ReportTransactionAdmin(ModelView, model=ReportTransaction):
     column_list = [
@@ -235,7 +240,7 @@ class DashboardView(BaseView):
 
     @expose("/admin/dashboard")
     def dashboard(self, request: Request):
-        db = SessionLocal()
+        db = read_session()
         try:
             total_users = db.query(func.count(User.id)).scalar()
             total_channels = db.query(func.count(Channel.id)).scalar()
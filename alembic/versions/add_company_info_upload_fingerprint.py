@@ -0,0 +1,28 @@
+"""add company info upload fingerprint
+
+Revision ID: add_company_info_upload_fingerprint
+Revises: add_company_reports_lookup_index
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_company_info_upload_fingerprint'
+down_revision: Union[str, None] = 'add_company_reports_lookup_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('company_info', sa.Column('upload_fingerprint', sa.String(64), nullable=True))
+    # Serves the duplicate upload check
+    op.create_index('ix_company_info_upload_fingerprint', 'company_info', ['upload_fingerprint'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_company_info_upload_fingerprint', table_name='company_info')
+    op.drop_column('company_info', 'upload_fingerprint')
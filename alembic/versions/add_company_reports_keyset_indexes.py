@@ -0,0 +1,32 @@
+"""add company reports keyset indexes
+
+Revision ID: add_company_reports_keyset_indexes
+Revises: add_company_info_upload_fingerprint
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_company_reports_keyset_indexes'
+down_revision: Union[str, None] = 'add_company_info_upload_fingerprint'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serve the (created_at, id) keyset pagination of report listings
+    op.create_index(
+        'ix_company_reports_user_created',
+        'company_reports',
+        ['processed_by_user_id', 'created_at', 'id']
+    )
+    op.create_index('ix_company_reports_created', 'company_reports', ['created_at', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_company_reports_created', table_name='company_reports')
+    op.drop_index('ix_company_reports_user_created', table_name='company_reports')
@@ -0,0 +1,30 @@
+"""add company reports lookup index
+
+Revision ID: add_company_reports_lookup_index
+Revises: b8031aa5a849, merge_heads_for_top_level_admin
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_company_reports_lookup_index'
+down_revision: Union[str, None] = ('b8031aa5a849', 'merge_heads_for_top_level_admin')
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serves the stored report lookup by taxpayer and period
+    op.create_index(
+        'ix_company_reports_lookup',
+        'company_reports',
+        ['company_tax_number', 'report_type', 'year', 'month', 'quarter']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_company_reports_lookup', table_name='company_reports')
@@ -0,0 +1,134 @@
+"""
+Compare the old database access of the async routes - a sync Session used
+inside `async def` endpoints - with the AsyncSession from database.py under
+concurrent requests.
+
+Both variants serve the same user lookup from a temporary SQLite database
+through httpx's ASGI transport. Every query calls a SQL function that sleeps
+for --query-delay seconds to mimic a round trip to MySQL. A ticker task
+measures how late the event loop wakes it up, which is the time other
+requests (Redis, third-party calls) would have been stalled.
+
+    python benchmarks/bench_db_concurrency.py --requests 200 --concurrency 20
+"""
+import sys
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base, async_database_url
+from models import User
+
+TICK_INTERVAL = 0.005
+
+def add_slow_function(engine, delay: float):
+    @event.listens_for(engine, "connect")
+    def register(dbapi_connection, connection_record):
+        dbapi_connection.create_function("slow", 1, lambda value: time.sleep(delay) or value)
+
+def build_app(url: str, delay: float) -> FastAPI:
+    sync_engine = create_engine(url, pool_size=20)
+    add_slow_function(sync_engine, delay)
+    SyncSession = sessionmaker(bind=sync_engine)
+
+    async_engine = create_async_engine(async_database_url(url), pool_size=20)
+    add_slow_function(async_engine.sync_engine, delay)
+    AsyncSessionFactory = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+    def get_sync_db():
+        db = SyncSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def get_async_db():
+        async with AsyncSessionFactory() as db:
+            yield db
+
+    app = FastAPI()
+
+    @app.get("/sync/{user_id}")
+    async def sync_lookup(user_id: int, db=Depends(get_sync_db)):
+        user = db.query(User).filter(User.id == user_id, User.id == func.slow(user_id)).first()
+        return {"username": user.username if user else None}
+
+    @app.get("/async/{user_id}")
+    async def async_lookup(user_id: int, db: AsyncSession = Depends(get_async_db)):
+        user = await db.scalar(select(User).where(User.id == user_id, User.id == func.slow(user_id)))
+        return {"username": user.username if user else None}
+
+    app.state.engines = (sync_engine, async_engine)
+    return app
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_INTERVAL)
+        lags.append((time.perf_counter() - started - TICK_INTERVAL) * 1000)
+
+async def run_requests(client: httpx.AsyncClient, path: str, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    lags = []
+    stop = asyncio.Event()
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(f"{path}/{i % 10 + 1}")
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    tick = asyncio.create_task(ticker(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    return latencies, lags, elapsed
+
+def report(name: str, latencies: list, lags: list, elapsed: float):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<14} total {elapsed:7.3f}s  mean {statistics.mean(latencies):8.2f}ms  "
+          f"p95 {p95:8.2f}ms  max loop lag {max(lags or [0]):8.2f}ms")
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        setup_engine = create_engine(url)
+        Base.metadata.create_all(setup_engine)
+        with sessionmaker(bind=setup_engine)() as db:
+            db.add_all([User(id=i, username=f"user{i}") for i in range(1, 11)])
+            db.commit()
+        setup_engine.dispose()
+
+        app = build_app(url, args.query_delay)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, path in (("sync session", "/sync"), ("async session", "/async")):
+                latencies, lags, elapsed = await run_requests(client, path, args.requests, args.concurrency)
+                report(name, latencies, lags, elapsed)
+
+        sync_engine, async_engine = app.state.engines
+        sync_engine.dispose()
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--query-delay", type=float, default=0.01,
+                        help="seconds each query spends in the database")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+"""
+Compare a new httpx.AsyncClient per call (the old behaviour of
+register_tenant / upload_company_info_batch / query_third_party_system)
+with the shared pooled client from services/http_client.py.
+
+A tiny keep-alive HTTP/1.1 server is started on localhost; it counts the TCP
+connections it accepts, so the saved connection setup shows up both as fewer
+connections and as lower per-call latency. --connect-delay adds an artificial
+delay on each new connection to mimic TCP/TLS setup to a remote host.
+
+    python benchmarks/bench_http_client.py --calls 200 --concurrency 10
+"""
+import sys
+import os
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from services.http_client import init_http_client, close_http_client
+
+RESPONSE_BODY = json.dumps({"status": 200, "msg": "ok", "data": {"riskMain": {}}}).encode()
+
+class StubServer:
+    def __init__(self, connect_delay: float):
+        self.connect_delay = connect_delay
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        if self.connect_delay:
+            await asyncio.sleep(self.connect_delay)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(RESPONSE_BODY)}\r\n\r\n".encode()
+                    + RESPONSE_BODY
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+async def run_calls(call, calls: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return latencies
+
+def report(name: str, latencies: list, elapsed: float, connections: int):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<22} total {elapsed:7.3f}s  mean {statistics.mean(latencies):7.2f}ms  "
+          f"p95 {p95:7.2f}ms  connections {connections}")
+
+async def main(args):
+    stub = StubServer(args.connect_delay)
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/skServer/yas/risk-report/simplified/ow-data"
+    payload = {"dateSource": "0", "dateType": "0", "year": "2023", "taxpayerNo": "TIN", "reportType": "annual"}
+
+    async def new_client_per_call():
+        async with httpx.AsyncClient() as client:
+            await client.post(url, json=payload)
+
+    started = time.perf_counter()
+    latencies = await run_calls(new_client_per_call, args.calls, args.concurrency)
+    report("new client per call", latencies, time.perf_counter() - started, stub.connections)
+
+    stub.connections = 0
+    shared = await init_http_client()
+
+    async def shared_client():
+        await shared.post(url, json=payload)
+
+    started = time.perf_counter()
+    latencies = await run_calls(shared_client, args.calls, args.concurrency)
+    report("shared pooled client", latencies, time.perf_counter() - started, stub.connections)
+
+    await close_http_client()
+    server.close()
+    await server.wait_closed()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--connect-delay", type=float, default=0.02,
+                        help="seconds of simulated setup cost per new connection")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,129 @@
+"""
+Compare peak Python memory of forwarding an upload batch the old way (read
+every UploadFile into bytes, then post the bytes) with the streaming path
+used by services/upload_jobs.py and upload_company_info_batch. The streaming
+path copies the spooled upload to disk in chunks and posts open file
+handles, which httpx reads chunk by chunk.
+
+A localhost HTTP/1.1 server drains each request body without keeping it.
+Peak allocations are measured with tracemalloc, so the numbers cover
+Python-level buffers (bytes, multipart encoder), not the kernel page cache.
+Needs no database or Redis.
+
+    python benchmarks/bench_upload_memory.py --files 4 --size-mb 32
+"""
+import sys
+import os
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from starlette.datastructures import UploadFile
+from config import settings
+from services.upload_files import save_upload_files
+
+RESPONSE_BODY = json.dumps({"status": 200, "msg": "ok"}).encode()
+CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+async def handle(reader, writer):
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            while length:
+                chunk = await reader.read(min(length, 64 * 1024))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", length)
+                length -= len(chunk)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(RESPONSE_BODY)}\r\n\r\n".encode()
+                + RESPONSE_BODY
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+def make_uploads(source_paths: list) -> list:
+    """
+    UploadFile objects backed by spooled temp files, as Starlette builds them
+    """
+    uploads = []
+    for path in source_paths:
+        spooled = tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_MAX_SIZE)
+        with open(path, 'rb') as source:
+            shutil.copyfileobj(source, spooled, settings.UPLOAD_COPY_CHUNK_SIZE)
+        spooled.seek(0)
+        uploads.append(UploadFile(file=spooled, filename=os.path.basename(path)))
+    return uploads
+
+async def buffered(client, url, uploads):
+    files_data = []
+    for upload in uploads:
+        content = await upload.read()
+        files_data.append(('files', (upload.filename, content, CONTENT_TYPE)))
+    await client.post(url, files=files_data)
+
+async def streamed(client, url, uploads):
+    saved = await save_upload_files("bench", uploads)
+    handles = [(f['filename'], open(f['path'], 'rb'), CONTENT_TYPE) for f in saved]
+    try:
+        await client.post(url, files=[('files', handle) for handle in handles])
+    finally:
+        for _, fileobj, _ in handles:
+            fileobj.close()
+
+async def measure(name, fn, client, url, source_paths):
+    uploads = make_uploads(source_paths)
+    tracemalloc.start()
+    started = time.perf_counter()
+    await fn(client, url, uploads)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for upload in uploads:
+        upload.file.close()
+    print(f"{name:<10} peak {peak / 1024 / 1024:8.2f} MiB  time {elapsed:6.2f}s")
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="bench_upload_")
+    settings.UPLOAD_JOB_DIR = os.path.join(workdir, "jobs")
+    source_paths = []
+    for index in range(args.files):
+        path = os.path.join(workdir, f"report_{index}.xlsx")
+        with open(path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        source_paths.append(path)
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/skServer/yas/getexcel/data-impcal"
+    print(f"{args.files} files x {args.size_mb} MiB, spool threshold "
+          f"{settings.UPLOAD_SPOOL_MAX_SIZE // 1024} KiB")
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            await measure("buffered", buffered, client, url, source_paths)
+            await measure("streamed", streamed, client, url, source_paths)
+    finally:
+        server.close()
+        await server.wait_closed()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
+from services.db_routing import get_read_db, mark_user_write
 from services import channel as channel_service
 from services.auth import get_current_user
 from models import User
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from typing import Optional
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
@@ -48,7 +51,7 @@ async def level2_user_reports(request: Request, user_id: int):
 
 @router.get("/api/channel/dashboard")
 async def get_channel_dashboard(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.channel_id:
@@ -57,7 +60,7 @@ async def get_channel_dashboard(
             detail="User is not associated with any channel"
         )
 
-    dashboard_data = channel_service.get_channel_dashboard_data(db, current_user.channel_id)
+    dashboard_data = await channel_service.get_channel_dashboard_data(db, current_user.channel_id)
     if not dashboard_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -66,10 +69,26 @@ async def get_channel_dashboard(
 
     return dashboard_data
 
+@router.get("/api/channel/reports")
+async def get_channel_reports(
+    cursor: Optional[str] = None,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Further pages of the channel's reports after the dashboard's first page"""
+    if not current_user.channel_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User is not associated with any channel"
+        )
+
+    return await channel_service.get_channel_reports(db, current_user.channel_id, cursor, page_size)
+
 @router.get("/api/report/{report_id}")
 async def get_report_details(
     report_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.channel_id:
@@ -78,7 +97,7 @@ async def get_report_details(
             detail="User is not associated with any channel"
         )
 
-    report_data = channel_service.get_report_details(db, report_id, current_user.channel_id)
+    report_data = await channel_service.get_report_details(db, report_id, current_user.channel_id)
     if not report_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -91,7 +110,9 @@ async def get_report_details(
 async def get_level2_user_reports_with_auth(
     channel_id: int,
     user_id: int,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_user)
 ):
     try:
@@ -107,7 +128,7 @@ async def get_level2_user_reports_with_auth(
             )
 
         # Get the level2 user
-        level2_user = db.query(User).filter(User.id == user_id).first()
+        level2_user = await db.scalar(select(User).where(User.id == user_id))
         if not level2_user:
             print(f"User {user_id} not found")
             raise HTTPException(
@@ -134,7 +155,7 @@ async def get_level2_user_reports_with_auth(
             )
 
         # Get the user's reports data
-        reports_data = channel_service.get_level2_user_reports_data(db, user_id)
+        reports_data = await channel_service.get_level2_user_reports_data(db, user_id, cursor, page_size)
         if not reports_data:
             print(f"No reports found for user {user_id}")
             raise HTTPException(
@@ -142,7 +163,7 @@ async def get_level2_user_reports_with_auth(
                 detail="Reports data not found"
             )
 
-        print(f"Found {len(reports_data['reports'])} reports for user {user_id}")
+        print(f"Found {len(reports_data['reports']['items'])} reports for user {user_id}")
         return reports_data
 
     except HTTPException:
@@ -157,7 +178,9 @@ async def get_level2_user_reports_with_auth(
 @router.get("/api/channel/user/{user_id}/reports")
 async def get_level2_user_reports(
     user_id: int,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
     current_user: User = Depends(get_current_user)
 ):
     # Check if the current user has access to this level2 user's reports
@@ -168,7 +191,7 @@ async def get_level2_user_reports(
         )
 
     # Get the level2 user
-    level2_user = db.query(User).filter(User.id == user_id).first()
+    level2_user = await db.scalar(select(User).where(User.id == user_id))
     if not level2_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -183,7 +206,7 @@ async def get_level2_user_reports(
         )
 
     # Get the user's reports data
-    reports_data = channel_service.get_level2_user_reports_data(db, user_id)
+    reports_data = await channel_service.get_level2_user_reports_data(db, user_id, cursor, page_size)
     if not reports_data:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -195,7 +218,7 @@ async def get_level2_user_reports(
 @router.post("/api/channel/deposit")
 async def deposit_funds(
     amount: float,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     if not current_user.channel_id:
@@ -210,7 +233,7 @@ async def deposit_funds(
             detail="Amount must be greater than 0"
         )
 
-    updated_channel = channel_service.update_channel_balance(
+    updated_channel = await channel_service.update_channel_balance(
         db, current_user.channel_id, amount
     )
     if not updated_channel:
@@ -218,5 +241,6 @@ async def deposit_funds(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Channel not found"
         )
+    await mark_user_write(current_user.id)
 
     return {"new_balance": updated_channel.balance}
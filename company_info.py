@@ -1,17 +1,22 @@
 from fastapi import APIRouter, Depends, status, HTTPException, UploadFile, File, Form, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated, List
 from datetime import datetime
 from pydantic import BaseModel
 import json
 import traceback
 
-from database import SessionLocal
+from database import get_db
 from models import User, CompanyInfo, CompanyReport
-from services.company import upload_company_info_batch, query_third_party_system
-from services.auth import check_redis_connection, redis_client, get_cached_token, register_tenant
+from services.company import query_third_party_system, prefetch_reports
+from services.upload_jobs import submit_upload_job, get_upload_job
+from services.auth import check_redis_connection, get_cached_token, register_tenant, get_token_cache_stats
+from services.redis_health import redis_health
+from services.resilience import breakers
+from services.db_routing import mark_user_write
 from utils.auth_utils import verify_user_ids, verify_access_token
 
 # Initialize router for API routes
@@ -23,14 +28,6 @@ page_router = APIRouter(tags=["pages"])
 # Initialize templates
 templates = Jinja2Templates(directory="templates")
 
-# Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @page_router.get("/upload_base_info", response_class=HTMLResponse)
 async def upload_base_info_page(request: Request):
     """Render upload base info page"""
@@ -50,12 +47,18 @@ async def download_report_page(request: Request):
 async def test_redis():
     """Test Redis connection"""
     try:
-        check_redis_connection()
-        return {"status": "success", "message": "Redis connection successful"}
+        await check_redis_connection()
+        return {
+            "status": "success",
+            "message": "Redis connection successful",
+            "redis_health": redis_health.status(),
+            "token_cache": get_token_cache_stats(),
+            "upstream_circuits": {endpoint: breaker.status() for endpoint, breaker in breakers.items()}
+        }
     except HTTPException as e:
-        return {"status": "error", "message": str(e.detail)}
+        return {"status": "error", "message": str(e.detail), "redis_health": redis_health.status()}
     except Exception as e:
-        return {"status": "error", "message": str(e)}
+        return {"status": "error", "message": str(e), "redis_health": redis_health.status()}
 
 class CompanyRegistration(BaseModel):
     """Schema for company registration"""
@@ -70,7 +73,7 @@ class CompanyRegistration(BaseModel):
 async def register_company(
     company_data: CompanyRegistration,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Register a new company"""
     try:
@@ -106,6 +109,70 @@ async def register_company(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def get_request_user_id(request: Request) -> int:
+    """Return the user ID from the Bearer token in the Authorization header"""
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    payload = verify_access_token(auth_header.split(" ")[1])
+    if not payload or not payload.get("user_id"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload.get("user_id")
+
+@api_router.post("/upload-company-info/{system_user_id}", status_code=status.HTTP_202_ACCEPTED)
+async def upload_company_info(
+    system_user_id: int,
+    request: Request,
+    date_source: int = Form(...),
+    date_type: int = Form(...),
+    year: int = Form(...),
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Queue company info files for upload to the Yi'an Tax system.
+    Returns a job ID to poll at /api/v1/upload-jobs/{job_id}.
+    """
+    try:
+        user_id = get_request_user_id(request)
+
+        user = await db.scalar(select(User).where(User.id == user_id))
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        # Fail fast instead of queueing a job that cannot be sent
+        if not await get_cached_token(system_user_id):
+            raise HTTPException(status_code=401, detail="Token not found. Please login first.")
+
+        job_id = await submit_upload_job(
+            system_user_id=system_user_id,
+            user_id=user.id,
+            date_source=date_source,
+            date_type=date_type,
+            year=year,
+            files=files
+        )
+        return {
+            "status": "queued",
+            "job_id": job_id,
+            "status_url": f"/api/v1/upload-jobs/{job_id}",
+            "timestamp": datetime.now().isoformat()
+        }
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/upload-jobs/{job_id}")
+async def upload_job_status(job_id: str, request: Request):
+    """Status and timings of a queued company info upload"""
+    user_id = get_request_user_id(request)
+    job = await get_upload_job(job_id)
+    if not job or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job
+
 class DownloadReportRequest(BaseModel):
     """Schema for download report request"""
     dateSource: int
@@ -115,13 +182,14 @@ class DownloadReportRequest(BaseModel):
     reportType: str
     month: int = None
     quarter: int = None
+    forceRefresh: bool = False
 
 @api_router.post("/download-report/{system_user_id}")
 async def download_report(
     system_user_id: int,
     report_data: DownloadReportRequest,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Download report for a specific system user"""
     try:
@@ -140,22 +208,12 @@ async def download_report(
             raise HTTPException(status_code=401, detail="Invalid token")
 
         # Get user from database
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Get token from Redis
-        token = None
-        for key in redis_client.scan_iter("yas_token:*"):
-            token_data = redis_client.get(key)
-            if token_data:
-                try:
-                    data = json.loads(token_data)
-                    if str(data.get('systemUserId')) == str(system_user_id):
-                        token = data.get('token')
-                        break
-                except json.JSONDecodeError:
-                    continue
+        token = await get_cached_token(system_user_id)
 
         if not token:
             raise HTTPException(status_code=401, detail="Token not found. Please login first.")
@@ -169,7 +227,8 @@ async def download_report(
             year=report_data.year,
             token=token,
             current_user=user,
-            report_type=report_data.reportType
+            report_type=report_data.reportType,
+            force_refresh=report_data.forceRefresh
         )
         return result
 
@@ -178,6 +237,63 @@ async def download_report(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class PrefetchReportsRequest(BaseModel):
+    """Schema for prefetching the reports of several periods of one year"""
+    year: int
+    reportType: str
+    periods: List[int] = None
+    dateSource: int = 0
+    forceRefresh: bool = False
+
+# Valid periods of each report type, also the default when none are given
+REPORT_PERIODS = {
+    'annual': [0],
+    'quarterly': list(range(1, 5)),
+    'monthly': list(range(1, 13))
+}
+
+@api_router.post("/download-report/{system_user_id}/prefetch")
+async def prefetch_report_periods(
+    system_user_id: int,
+    prefetch_data: PrefetchReportsRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """Fetch and store the reports of several periods at once"""
+    try:
+        user_id = get_request_user_id(request)
+
+        if prefetch_data.reportType not in REPORT_PERIODS:
+            raise HTTPException(status_code=400, detail="Invalid report type")
+        valid_periods = REPORT_PERIODS[prefetch_data.reportType]
+        periods = sorted(set(prefetch_data.periods or valid_periods))
+        if any(period not in valid_periods for period in periods):
+            raise HTTPException(status_code=400, detail=f"Invalid periods for {prefetch_data.reportType} reports")
+
+        user = await db.scalar(select(User).where(User.id == user_id))
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        token = await get_cached_token(system_user_id)
+        if not token:
+            raise HTTPException(status_code=401, detail="Token not found. Please login first.")
+
+        return await prefetch_reports(
+            db=db,
+            token=token,
+            current_user=user,
+            year=prefetch_data.year,
+            report_type=prefetch_data.reportType,
+            periods=periods,
+            date_source=prefetch_data.dateSource,
+            force_refresh=prefetch_data.forceRefresh
+        )
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 class StoreReportRequest(BaseModel):
     """Schema for storing report"""
     user_id: int
@@ -192,7 +308,7 @@ class StoreReportRequest(BaseModel):
 async def store_report(
     report_data: StoreReportRequest,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Store a report in the database"""
     try:
@@ -201,19 +317,19 @@ async def store_report(
         tax_number = report_data.company_tax_number
         
         # First, try to find an existing user by checking CompanyInfo records
-        company_info = db.query(CompanyInfo).filter(
-            CompanyInfo.tax_number == tax_number
-        ).first()
+        company_info = await db.scalar(
+            select(CompanyInfo).where(CompanyInfo.tax_number == tax_number).limit(1)
+        )
         
         if company_info and company_info.post_initiator_user_id:
-            actual_user = db.query(User).filter(
-                User.id == company_info.post_initiator_user_id
-            ).first()
+            actual_user = await db.scalar(
+                select(User).where(User.id == company_info.post_initiator_user_id)
+            )
         else:
             # If no existing user found, find any admin user to associate with
-            actual_user = db.query(User).filter(
-                User.is_admin == True
-            ).first()
+            actual_user = await db.scalar(
+                select(User).where(User.is_admin == True).limit(1)
+            )
             
             if not actual_user:
                 # If no admin user exists, create a new system user
@@ -225,8 +341,8 @@ async def store_report(
                     role="system"
                 )
                 db.add(actual_user)
-                db.commit()
-                db.refresh(actual_user)
+                await db.commit()
+                await db.refresh(actual_user)
 
         # Validate report type
         valid_report_types = ['annual', 'monthly', 'quarterly']
@@ -248,23 +364,26 @@ async def store_report(
                 status=True
             )
             db.add(company_info)
-            db.commit()
-            db.refresh(company_info)
+            await db.commit()
+            await db.refresh(company_info)
 
         # Check if report already exists
-        existing_report = db.query(CompanyReport).filter(
-            CompanyReport.company_tax_number == tax_number,
-            CompanyReport.report_type == report_data.report_type,
-            CompanyReport.year == report_data.year,
-            CompanyReport.month == report_data.month,
-            CompanyReport.quarter == report_data.quarter
-        ).first()
+        existing_report = await db.scalar(
+            select(CompanyReport).where(
+                CompanyReport.company_tax_number == tax_number,
+                CompanyReport.report_type == report_data.report_type,
+                CompanyReport.year == report_data.year,
+                CompanyReport.month == report_data.month,
+                CompanyReport.quarter == report_data.quarter
+            ).limit(1)
+        )
 
         if existing_report:
             # Update existing report
             existing_report.report_data = report_data.report_data
-            existing_report.updated_at = datetime.now()
-            db.commit()
+            existing_report.updated_at = func.now()
+            await db.commit()
+            await mark_user_write(actual_user.id)
             return {"message": "Report updated successfully", "report_id": existing_report.id}
         else:
             # Create new report
@@ -278,8 +397,9 @@ async def store_report(
                 report_data=report_data.report_data
             )
             db.add(new_report)
-            db.commit()
-            db.refresh(new_report)
+            await db.commit()
+            await db.refresh(new_report)
+            await mark_user_write(actual_user.id)
             return {"message": "Report stored successfully", "report_id": new_report.id}
 
     except HTTPException as he:
@@ -2,8 +2,8 @@ from fastapi.templating import Jinja2Templates
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
-from sqlalchemy.orm import Session
-from database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
 from utils.auth_utils import verify_access_token
 
 # Configure Jinja2 Templates with absolute path
@@ -13,17 +13,9 @@ templates = Jinja2Templates(directory=template_path)
 # Security scheme for JWT token
 security = HTTPBearer()
 
-def get_db():
-    """Database dependency"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> dict:
     """Get current authenticated user"""
     try:
@@ -1,32 +1,71 @@
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import List, Optional
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, Form, Request, Response
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from database import SessionLocal, engine
+from database import SessionLocal, engine, get_async_engine, get_async_replica_engines
 import models
-from services.auth import get_cached_token, check_redis_connection, register_tenant, get_cached_tin, redis_client
+from services.auth import get_cached_token, check_redis_connection, register_tenant, get_cached_tin
+from services.redis_client import init_redis, close_redis
+from services.redis_health import redis_health
+from services.http_client import init_http_client, close_http_client
+from services.token_refresh import token_refresh_scheduler
+from services.upload_jobs import upload_job_workers
+from services.spreadsheet_validation import shutdown_validation_pool
+from services.db_routing import replica_lag_monitor
+from config import settings
 from services.top_level_admin import TopLevelAdminService
 from utils.auth_utils import get_system_user_id_from_request, verify_password, create_access_token, verify_access_token
 from admin import create_admin
 from company_info import create_company_info
 import channel
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.formparsers import MultiPartParser
 import json
 from utils.token_utils import SECRET_KEY
 import os
 from routes.top_level_admin import router as top_level_admin_router
 from routes.second_level_user import router as second_level_user_router
+from routes.metrics import router as metrics_router
 from dependencies import templates, get_db
 
 # Import internationalization utilities
 from i18n import translation_manager, gettext as _
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients on startup and release them on shutdown"""
+    # Fail on a missing async driver at startup, not on the first request
+    get_async_engine()
+    get_async_replica_engines()
+    await init_redis()
+    await init_http_client()
+    redis_health.start()
+    replica_lag_monitor.start()
+    if settings.TOKEN_REFRESH_ENABLED:
+        token_refresh_scheduler.start()
+    upload_job_workers.start()
+    try:
+        yield
+    finally:
+        await upload_job_workers.stop()
+        shutdown_validation_pool()
+        await token_refresh_scheduler.stop()
+        await replica_lag_monitor.stop()
+        await redis_health.stop()
+        await close_http_client()
+        await close_redis()
+
 # Create FastAPI app instance
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Bound how much of each uploaded file is kept in memory while parsing forms
+MultiPartParser.spool_max_size = settings.UPLOAD_SPOOL_MAX_SIZE
 
 # Add CORS middleware
 app.add_middleware(
@@ -75,6 +114,7 @@ company_info_router = create_company_info(app)
 app.include_router(channel.router)
 app.include_router(top_level_admin_router)
 app.include_router(second_level_user_router)
+app.include_router(metrics_router)
 
 # Routes
 @app.get("/", response_class=HTMLResponse)
@@ -94,7 +134,7 @@ async def login_page(request: Request):
     })
 
 @app.get("/channel/dashboard", response_class=HTMLResponse)
-async def channel_dashboard_page(request: Request, db: Session = Depends(get_db)):
+async def channel_dashboard_page(request: Request, db: AsyncSession = Depends(get_db)):
     """Render channel dashboard page"""
     return templates.TemplateResponse("channel_dashboard.html", {
         "request": request,
@@ -103,7 +143,7 @@ async def channel_dashboard_page(request: Request, db: Session = Depends(get_db)
     })
 
 @app.post("/login")
-async def login(request: Request, db: Session = Depends(get_db)):
+async def login(request: Request, db: AsyncSession = Depends(get_db)):
     """Handle user login"""
     try:
         form_data = await request.form()
@@ -121,7 +161,7 @@ async def login(request: Request, db: Session = Depends(get_db)):
                 }
             )
 
-        user = db.query(models.User).filter(models.User.username == username).first()
+        user = await db.scalar(select(models.User).where(models.User.username == username).limit(1))
         
         if user:
             print(f"User found - ID: {user.id}, Role: {user.role}, Channel: {user.channel_id}")
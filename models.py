@@ -1,6 +1,6 @@
 from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, JSON, Float, UniqueConstraint, Index
 from database import Base, engine
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 
 class Channel(Base):
@@ -64,6 +64,7 @@ class CompanyInfo(Base):
     post_initiator_user_id = Column(Integer, ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
     status = Column(Boolean)  # Whether the post was successful
     query_result = Column(String(225), nullable=True)  # Store the query result
+    upload_fingerprint = Column(String(64), nullable=True)  # SHA-256 of upload parameters and file contents
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # Added timestamp
 
     user = relationship("User")
@@ -71,6 +72,7 @@ class CompanyInfo(Base):
 
     __table_args__ = (
         Index('ix_company_info_tax_number', 'tax_number'),
+        Index('ix_company_info_upload_fingerprint', 'upload_fingerprint'),
     )
 
 class CompanyReport(Base):
@@ -83,13 +85,25 @@ class CompanyReport(Base):
     year = Column(Integer, nullable=False)
     month = Column(Integer, nullable=True)  # For monthly reports
     quarter = Column(Integer, nullable=True)  # For quarterly reports
-    report_data = Column(JSON, nullable=False)
+    # The payload is large; it is only loaded where undefer() asks for it
+    # (report details, served cached reports), and raises anywhere else
+    # instead of quietly issuing a query per row
+    report_data = deferred(Column(JSON, nullable=False), raiseload=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     processed_by_user = relationship("User", back_populates="company_reports")
     company_info = relationship("CompanyInfo", back_populates="company_reports")
 
+    __table_args__ = (
+        # Lookup of the stored report for a taxpayer and period
+        Index('ix_company_reports_lookup', 'company_tax_number', 'report_type', 'year', 'month', 'quarter'),
+        # Keyset pagination of report listings (see utils/pagination.py),
+        # per user and across a channel's users
+        Index('ix_company_reports_user_created', 'processed_by_user_id', 'created_at', 'id'),
+        Index('ix_company_reports_created', 'created_at', 'id'),
+    )
+
 class ReportTransaction(Base):
     __tablename__ = "report_transactions"
 
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-from typing import Dict, Any
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Any, Optional
 
-from dependencies import get_db, get_current_user, templates
+from dependencies import get_current_user, templates
 from services import second_level_user
+from services.db_routing import get_read_db
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from fastapi.responses import HTMLResponse
 
 router = APIRouter()
@@ -18,7 +20,7 @@ async def second_level_dashboard_page(request: Request):
 
 @router.get("/api/second-level/dashboard", response_model=Dict[str, Any])
 async def get_second_level_dashboard(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: Dict = Depends(get_current_user)
 ):
     """Get dashboard data for second level user"""
@@ -38,3 +40,24 @@ async def get_second_level_dashboard(
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/second-level/reports", response_model=Dict[str, Any])
+async def get_second_level_reports(
+    cursor: Optional[str] = None,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Further pages of the second level user's reports after the dashboard's first page"""
+    if current_user["role"] != "level_2":
+        raise HTTPException(
+            status_code=403,
+            detail="Only second level users can access this endpoint"
+        )
+
+    return await second_level_user.get_company_reports(
+        db=db,
+        user_id=current_user["user_id"],
+        cursor=cursor,
+        page_size=page_size
+    )
@@ -1,35 +1,42 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Request, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.responses import HTMLResponse
-from typing import Dict
+from typing import Dict, Optional
 
-from database import get_db
+from services.db_routing import get_read_db
 from models import User
-from services.top_level_admin import TopLevelAdminService
+from services.top_level_admin import TopLevelAdminService, CHANNELS_PAGE_SIZE
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from services.top_level_auth import check_top_level_admin
 from dependencies import templates
+from services.redis_usage import collect_key_family_report, MAX_SAMPLE_PER_FAMILY
+from services.auth import check_redis_connection
 
 router = APIRouter(prefix="/topadmin", tags=["top_level_admin"])
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def admin_dashboard_page(
     request: Request,
+    page: int = Query(1, ge=1),
     current_user: User = Depends(check_top_level_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Render top level admin dashboard page"""
     try:
         print("Fetching dashboard data...")
-        stats = TopLevelAdminService.get_dashboard_stats(db)
+        stats = await TopLevelAdminService.get_dashboard_stats(db)
         print(f"Stats: {stats}")
-        channels = TopLevelAdminService.get_all_channels(db)
-        print(f"Channels: {channels}")
+        channels = await TopLevelAdminService.get_all_channels(db, page=page)
+        print(f"Channels on page {page}: {len(channels)}")
         
         return templates.TemplateResponse("top_level_admin_dashboard.html", {
             "request": request,
             "current_user": current_user,
             "stats": stats,
             "channels": channels,
+            "page": page,
+            "total_pages": max(1, -(-stats["total_channels"] // CHANNELS_PAGE_SIZE)),
             "locale": 'zh'
         })
     except Exception as e:
@@ -40,51 +47,87 @@ async def admin_dashboard_page(
 async def get_channel_details(
     request: Request,
     channel_id: int,
+    page: int = Query(1, ge=1),
     current_user: User = Depends(check_top_level_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get detailed information about a specific channel"""
-    channel_details = TopLevelAdminService.get_channel_details(db, channel_id)
+    channel_details = await TopLevelAdminService.get_channel_details(db, channel_id, page=page)
     return templates.TemplateResponse("admin_channel_details.html", {
         "request": request,
         "current_user": current_user,
         "channel": channel_details,
+        "total_pages": max(1, -(-channel_details["total_users"] // channel_details["page_size"])),
         "locale": 'zh'
     })
 
+@router.get("/api/channel/{channel_id}/user/{user_id}/reports")
+async def get_channel_user_reports(
+    channel_id: int,
+    user_id: int,
+    cursor: Optional[str] = None,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(check_top_level_admin),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """One page of a channel user's report listing, for the channel detail page"""
+    return await TopLevelAdminService.get_channel_user_reports(db, channel_id, user_id, cursor, page_size)
+
 @router.get("/user/{user_id}/reports", response_class=HTMLResponse)
 async def get_user_reports(
     request: Request,
     user_id: int,
     current_user: User = Depends(check_top_level_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Get all reports for a specific user"""
-    user = db.query(User).filter(User.id == user_id).first()
+    """Get the first page of reports for a specific user"""
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    reports = TopLevelAdminService.get_user_reports(db, user_id)
+    reports = await TopLevelAdminService.get_user_reports(db, user_id)
     return templates.TemplateResponse("admin_user_reports.html", {
         "request": request,
         "current_user": current_user,
         "user": user,
         "reports": reports,
+        "total_reports": await TopLevelAdminService.count_user_reports(db, user_id),
         "locale": 'zh'
     })
 
+@router.get("/api/user/{user_id}/reports")
+async def get_user_reports_page(
+    user_id: int,
+    cursor: Optional[str] = None,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(check_top_level_admin),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Further pages of a user's reports, for the user reports page"""
+    return await TopLevelAdminService.get_user_reports(db, user_id, cursor, page_size)
+
 @router.get("/report/{report_id}", response_class=HTMLResponse)
 async def get_report_details(
     request: Request,
     report_id: int,
     current_user: User = Depends(check_top_level_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get detailed information about a specific report"""
-    report = TopLevelAdminService.get_report_details(db, report_id)
+    report = await TopLevelAdminService.get_report_details(db, report_id)
     return templates.TemplateResponse("admin_report_details.html", {
         "request": request,
         "current_user": current_user,
         "report": report,
         "locale": 'zh'
     })
+
+@router.get("/api/redis-usage")
+async def get_redis_usage(
+    sample: int = Query(100, ge=0, le=MAX_SAMPLE_PER_FAMILY),
+    current_user: User = Depends(check_top_level_admin)
+):
+    """Per key family counts, estimated memory and TTL histograms of Redis"""
+    # 503 straight away instead of a long SCAN against a degraded Redis
+    await check_redis_connection()
+    return await collect_key_family_report(sample_per_family=sample)
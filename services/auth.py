@@ -1,39 +1,75 @@
-import httpx
 from fastapi import HTTPException, Depends, Request
 import redis
 from datetime import datetime
 import json
 import traceback
+import time
 import socket
-from sqlalchemy.orm import Session
-from database import SessionLocal
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
 from utils.token_utils import verify_access_token
 from models import User
+from config import settings
+from utils.ttl_cache import TTLCache
+from services.redis_client import get_redis
+from services.http_client import get_http_client, endpoint_timeout, endpoint_url
+from services.resilience import call_upstream
+from services.redis_health import redis_health
+from utils.metrics import metrics
 
-# Initialize Redis connection with error handling
-try:
-    redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
-    redis_client.ping()
-    print("Successfully connected to Redis")
-except redis.ConnectionError as e:
-    print(f"Failed to connect to Redis: {e}")
-    print("Please ensure Redis server is running")
-    redis_client = None
-except Exception as e:
-    print(f"Unexpected error connecting to Redis: {e}")
-    redis_client = None
+# Key layout: the token record is a hash under yas_token:{systemUserId}, and a
+# reverse index yas_token_index:{token} -> systemUserId (same TTL) lets token
+# lookups resolve with a single GET instead of scanning every tenant.
+# company_registration:{systemUserId} holds the registration form as a hash.
+TOKEN_KEY_PREFIX = "yas_token:"
+TOKEN_INDEX_KEY_PREFIX = "yas_token_index:"
+REGISTRATION_KEY_PREFIX = "company_registration:"
+# Sorted set of systemUserId scored by token expiry (unix seconds), used by
+# the token refresh scheduler to find tokens about to lapse
+TOKEN_EXPIRY_KEY = "yas_token_expiry"
 
-def get_db():
+def token_key(system_user_id) -> str:
     """
-    Database session dependency
+    Redis key holding the token record of a system user
     """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    return f"{TOKEN_KEY_PREFIX}{system_user_id}"
+
+def token_index_key(token: str) -> str:
+    """
+    Redis key mapping a third-party token back to its system user
+    """
+    return f"{TOKEN_INDEX_KEY_PREFIX}{token}"
+
+def registration_key_for(system_user_id) -> str:
+    """
+    Redis key holding the company registration data of a system user
+    """
+    return f"{REGISTRATION_KEY_PREFIX}{system_user_id}"
+
+# Token record fields read on request paths; token must stay first
+TOKEN_READ_FIELDS = ['token', 'systemUserId', 'tenantId', 'expirationTime', 'taxpayerNo']
+
+# Per-process cache of token records keyed by systemUserId. Entries never
+# outlive the record's expirationTime and are dropped on clear/re-registration.
+token_cache = TTLCache(max_entries=settings.TOKEN_CACHE_MAX_ENTRIES)
+
+def get_token_cache_stats() -> dict:
+    """
+    Hit/miss counters of the in-process token cache
+    """
+    return token_cache.stats()
+
+def _collect_token_cache(registry):
+    stats = token_cache.stats()
+    registry.set("token_cache_entries", stats["size"])
+    registry.set("token_cache_hits", stats["hits"])
+    registry.set("token_cache_misses", stats["misses"])
+    registry.set("token_cache_evictions", stats["evictions"])
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
+metrics.add_collector(_collect_token_cache)
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)) -> User:
     """
     Get the current authenticated user from the request
     """
@@ -54,7 +90,7 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)) -> U
                 detail="Invalid token payload"
             )
         
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user:
             raise HTTPException(
                 status_code=404,
@@ -83,6 +119,53 @@ def parse_datetime(datetime_str: str) -> datetime:
             print(f"Error parsing datetime: {datetime_str}")
             raise e
 
+def to_hash_fields(data: dict) -> dict:
+    """
+    Flatten a record into Redis hash fields. None is stored as an empty string.
+    """
+    return {k: '' if v is None else str(v) for k, v in data.items()}
+
+def from_hash_fields(fields: dict) -> dict:
+    """
+    Inverse of to_hash_fields for values read back from Redis
+    """
+    return {k: (v if v != '' else None) for k, v in fields.items()}
+
+async def store_token_record(token_data: dict, registration_data: dict, ttl: int):
+    """
+    Write the token hash, the company registration hash, the token index,
+    the expiry schedule entry and their TTLs in a single MULTI/EXEC round trip
+    """
+    system_user_id = token_data['systemUserId']
+    redis_key = token_key(system_user_id)
+    registration_key = registration_key_for(system_user_id)
+    if settings.TOKEN_MAX_TTL_SECONDS:
+        ttl = min(ttl, settings.TOKEN_MAX_TTL_SECONDS)
+    registration_ttl = settings.COMPANY_REGISTRATION_TTL_SECONDS or ttl
+
+    redis_client = get_redis()
+    try:
+        old_token = await redis_client.hget(redis_key, 'token')
+    except redis.ResponseError:
+        # Legacy JSON string record, see utils/convert_token_records.py
+        old_token = None
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        # DEL first so stale fields (or a legacy JSON string) never survive
+        pipe.delete(redis_key, registration_key)
+        if old_token and old_token != token_data['token']:
+            # Index entry of the token this registration replaces
+            pipe.delete(token_index_key(old_token))
+        pipe.hset(redis_key, mapping=to_hash_fields(token_data))
+        pipe.expire(redis_key, ttl)
+        pipe.hset(registration_key, mapping=to_hash_fields(registration_data))
+        pipe.expire(registration_key, registration_ttl)
+        pipe.setex(token_index_key(token_data['token']), ttl, str(system_user_id))
+        pipe.zadd(TOKEN_EXPIRY_KEY, {str(system_user_id): time.time() + ttl})
+        await pipe.execute()
+
+    token_cache.pop(str(system_user_id))
+
 async def register_tenant(company_data: dict):
     """
     Register tenant with the Yi'an Tax system and store token in Redis
@@ -92,104 +175,84 @@ async def register_tenant(company_data: dict):
         print(f"Request Data: {json.dumps(company_data, indent=2)}")
         
         # Ensure Redis is available
-        check_redis_connection()
+        await check_redis_connection()
         
         # Make request to external API
-        async with httpx.AsyncClient() as client:
-            print("\nSending POST request to registration endpoint...")
-            response = await client.post(
-                'http://test-yas.hthuiyou.com/skServer/yas/tenantid/register',
-                json=company_data
-            )
-            
-            print(f"\nResponse Status Code: {response.status_code}")
-            print(f"Response Headers: {dict(response.headers)}")
-            print(f"Response Body: {response.text}")
-            
-            data = response.json()
-            print(f"\nParsed Response Data: {json.dumps(data, indent=2)}")
+        client = get_http_client()
+        print("\nSending POST request to registration endpoint...")
+        # Registering the same tenant again is safe, so failures are retried
+        response = await call_upstream(
+            'register',
+            lambda: client.post(
+                endpoint_url('register'),
+                json=company_data,
+                timeout=endpoint_timeout('register')
+            ),
+            idempotent=True
+        )
+        
+        print(f"\nResponse Status Code: {response.status_code}")
+        print(f"Response Headers: {dict(response.headers)}")
+        print(f"Response Body: {response.text}")
+        
+        data = response.json()
+        print(f"\nParsed Response Data: {json.dumps(data, indent=2)}")
+        
+        if data.get('status') == 200:
+            print("\nRegistration successful, processing token...")
+            token_data = {
+                'token': data['data']['token'],
+                'systemUserId': data['data']['systemUserId'],
+                'userId': company_data.get('userId'),
+                'tenantId': data['data']['tenantId'],
+                'expirationTime': data['data']['expirationTime'],
+                'taxpayerNo': company_data.get('taxpayerNo'),
+                'companyName': company_data.get('companyName'),
+                'indexStandardType': company_data.get('indexStandardType'),
+                'industry': company_data.get('industry'),
+                'registrationType': company_data.get('registrationType'),
+                'taxpayerNature': company_data.get('taxpayerNature')
+            }
             
-            if data.get('status') == 200:
-                print("\nRegistration successful, processing token...")
-                token_data = {
-                    'token': data['data']['token'],
-                    'systemUserId': data['data']['systemUserId'],
-                    'userId': company_data.get('userId'),
-                    'tenantId': data['data']['tenantId'],
-                    'expirationTime': data['data']['expirationTime'],
-                    'taxpayerNo': company_data.get('taxpayerNo'),
+            try:
+                print(f"\nParsing expiration time: {data['data']['expirationTime']}")
+                expiration = parse_datetime(data['data']['expirationTime'])
+                ttl = int((expiration - datetime.utcnow()).total_seconds())
+                
+                print(f"\nStoring token in Redis:")
+                print(f"Key: {token_key(data['data']['systemUserId'])}")
+                print(f"TTL: {ttl} seconds")
+                print(f"Token Data: {json.dumps(token_data, indent=2)}")
+                
+                registration_data = {
                     'companyName': company_data.get('companyName'),
                     'indexStandardType': company_data.get('indexStandardType'),
                     'industry': company_data.get('industry'),
                     'registrationType': company_data.get('registrationType'),
-                    'taxpayerNature': company_data.get('taxpayerNature')
+                    'taxpayerNature': company_data.get('taxpayerNature'),
+                    'taxpayerNo': company_data.get('taxpayerNo')
                 }
+                await store_token_record(token_data, registration_data, ttl)
                 
-                try:
-                    print(f"\nParsing expiration time: {data['data']['expirationTime']}")
-                    expiration = parse_datetime(data['data']['expirationTime'])
-                    ttl = int((expiration - datetime.utcnow()).total_seconds())
-                    
-                    print(f"\nStoring token in Redis:")
-                    print(f"Key: yas_token:{data['data']['systemUserId']}")
-                    print(f"TTL: {ttl} seconds")
-                    print(f"Token Data: {json.dumps(token_data, indent=2)}")
-                    
-                    redis_key = f"yas_token:{data['data']['systemUserId']}"
-                    
-                    registration_key = f"company_registration:{data['data']['systemUserId']}"
-                    registration_data = {
-                        'companyName': company_data.get('companyName'),
-                        'indexStandardType': company_data.get('indexStandardType'),
-                        'industry': company_data.get('industry'),
-                        'registrationType': company_data.get('registrationType'),
-                        'taxpayerNature': company_data.get('taxpayerNature'),
-                        'taxpayerNo': company_data.get('taxpayerNo')
-                    }
-                    redis_client.setex(
-                        registration_key,
-                        ttl,
-                        json.dumps(registration_data, ensure_ascii=False)
-                    )
-                    
-                    token_json = json.dumps(token_data, ensure_ascii=False)
-                    print(f"Formatted token JSON: {token_json}")
-                    
-                    redis_client.setex(
-                        redis_key,
-                        ttl,
-                        token_json
-                    )
-                    
-                    stored_data = redis_client.get(redis_key)
-                    if stored_data:
-                        try:
-                            parsed_data = json.loads(stored_data)
-                            print(f"\nVerified stored token data: {json.dumps(parsed_data, indent=2)}")
-                        except json.JSONDecodeError as e:
-                            print(f"Error: Stored data is not valid JSON: {stored_data}")
-                            raise Exception(f"Failed to store valid JSON token: {e}")
-                    else:
-                        raise Exception("Failed to verify stored token")
-                    
-                    return data['data']
-                except redis.RedisError as e:
-                    print(f"\nRedis error storing token: {str(e)}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Redis error: {str(e)}"
-                    )
-                except Exception as e:
-                    print(f"\nError storing token in Redis: {str(e)}")
-                    print(f"Stack trace: {traceback.format_exc()}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Failed to store token in Redis: {str(e)}"
-                    )
-            else:
-                print(f"\nRegistration failed: {data.get('msg', 'Unknown error')}")
-                raise HTTPException(status_code=400, detail=data.get('msg', 'Registration failed'))
-                
+                return data['data']
+            except redis.RedisError as e:
+                redis_health.record_failure(e)
+                print(f"\nRedis error storing token: {str(e)}")
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Redis error: {str(e)}"
+                )
+            except Exception as e:
+                print(f"\nError storing token in Redis: {str(e)}")
+                print(f"Stack trace: {traceback.format_exc()}")
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to store token in Redis: {str(e)}"
+                )
+        else:
+            print(f"\nRegistration failed: {data.get('msg', 'Unknown error')}")
+            raise HTTPException(status_code=400, detail=data.get('msg', 'Registration failed'))
+            
     except HTTPException as he:
         print(f"\nHTTP Exception during registration: {str(he)}")
         raise
@@ -198,34 +261,61 @@ async def register_tenant(company_data: dict):
         print(f"Stack trace: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
-def check_redis_connection():
+async def check_redis_connection():
     """
-    Check if Redis connection is available
+    Check if Redis connection is available.
+    Uses the state kept by the background health monitor instead of a PING.
     """
-    print("\n=== Checking Redis Connection ===")
-    if not redis_client:
+    if not get_redis():
         raise HTTPException(
             status_code=500,
             detail="Redis connection not available. Please ensure Redis server is running."
         )
-    try:
-        redis_client.ping()
-        print("Redis connection check successful")
-        return True
-    except redis.RedisError as e:
-        print(f"Redis connection error: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Lost connection to Redis: {str(e)}"
-        )
-    except Exception as e:
-        print(f"Unexpected error checking Redis: {str(e)}")
+    if not redis_health.allow_request():
         raise HTTPException(
-            status_code=500,
-            detail=f"Unexpected Redis error: {str(e)}"
+            status_code=503,
+            detail=f"Redis unavailable: {redis_health.last_error or 'circuit open'}"
         )
+    return True
+
+def _token_cache_ttl(data: dict) -> float:
+    """
+    Seconds a token record may stay in the in-process cache
+    """
+    try:
+        expiration = parse_datetime(data['expirationTime'])
+    except (KeyError, TypeError, ValueError):
+        return 0
+    remaining = (expiration - datetime.utcnow()).total_seconds()
+    return min(remaining, settings.TOKEN_CACHE_MAX_TTL_SECONDS)
+
+async def get_token_data(system_user_id) -> dict:
+    """
+    Load the fields of a system user's token record needed on request paths,
+    or None if absent. Served from the in-process cache when possible.
+    """
+    cache_key = str(system_user_id)
+    data = token_cache.get(cache_key)
+    if data is not None:
+        return data
+
+    await check_redis_connection()
+    values = await get_redis().hmget(token_key(system_user_id), TOKEN_READ_FIELDS)
+    if not values[0]:
+        return None
+    data = from_hash_fields(dict(zip(TOKEN_READ_FIELDS, values)))
+
+    token_cache.set(cache_key, data, _token_cache_ttl(data))
+    return data
+
+async def get_registration_data(system_user_id) -> dict:
+    """
+    Company registration data stored alongside a system user's token
+    """
+    fields = await get_redis().hgetall(registration_key_for(system_user_id))
+    return from_hash_fields(fields)
 
-def get_cached_token(system_user_id: int) -> str:
+async def get_cached_token(system_user_id: int) -> str:
     """
     Get cached token from Redis
     """
@@ -233,25 +323,17 @@ def get_cached_token(system_user_id: int) -> str:
         print(f"\n=== Getting Cached Token ===")
         print(f"Looking for token with system_user_id: {system_user_id}")
         
-        check_redis_connection()
-        
-        redis_key = f"yas_token:{system_user_id}"
-        token_data = redis_client.get(redis_key)
-        print(f"Retrieved raw token data: {token_data}")
-        
-        if token_data:
-            try:
-                data = json.loads(token_data)
-                print(f"Parsed token data: {json.dumps(data, indent=2)}")
-                return data.get('token')
-            except json.JSONDecodeError as e:
-                print(f"Error parsing token data: {str(e)}")
-                print(f"Invalid token data: {token_data}")
-                return None
+        data = await get_token_data(system_user_id)
+        if data:
+            return data.get('token')
         
         print("No token found in cache")
         return None
+    except HTTPException:
+        # Redis unavailable (503) from check_redis_connection
+        raise
     except redis.RedisError as e:
+        redis_health.record_failure(e)
         print(f"Redis error retrieving token: {str(e)}")
         return None
     except Exception as e:
@@ -259,7 +341,7 @@ def get_cached_token(system_user_id: int) -> str:
         print(f"Stack trace: {traceback.format_exc()}")
         return None
 
-def get_cached_tin(system_user_id: int) -> str:
+async def get_cached_tin(system_user_id: int) -> str:
     """
     Get cached TIN from Redis
     """
@@ -267,24 +349,19 @@ def get_cached_tin(system_user_id: int) -> str:
         print(f"\n=== Getting Cached TIN ===")
         print(f"Looking for TIN with system_user_id: {system_user_id}")
         
-        check_redis_connection()
-        
-        redis_key = f"yas_token:{system_user_id}"
-        token_data = redis_client.get(redis_key)
-        
-        if token_data:
-            try:
-                data = json.loads(token_data)
-                tin = data.get('taxpayerNo')
-                print(f"Retrieved TIN: {tin}")
-                return tin
-            except json.JSONDecodeError as e:
-                print(f"Error parsing token data: {str(e)}")
-                return None
+        data = await get_token_data(system_user_id)
+        if data:
+            tin = data.get('taxpayerNo')
+            print(f"Retrieved TIN: {tin}")
+            return tin
         
         print("No TIN found in cache")
         return None
+    except HTTPException:
+        # Redis unavailable (503) from check_redis_connection
+        raise
     except redis.RedisError as e:
+        redis_health.record_failure(e)
         print(f"Redis error retrieving TIN: {str(e)}")
         return None
     except Exception as e:
@@ -292,7 +369,21 @@ def get_cached_tin(system_user_id: int) -> str:
         print(f"Stack trace: {traceback.format_exc()}")
         return None
 
-def validate_token(token: str) -> bool:
+async def find_token_data(token: str) -> dict:
+    """
+    Resolve a third-party token to its token record through the reverse index
+    """
+    system_user_id = await get_redis().get(token_index_key(token))
+    if not system_user_id:
+        return None
+
+    data = await get_token_data(system_user_id)
+    # The index entry of a superseded token may outlive the re-registration
+    if not data or data.get('token') != token:
+        return None
+    return data
+
+async def validate_token(token: str) -> bool:
     """
     Validate if token exists in Redis cache
     """
@@ -300,26 +391,19 @@ def validate_token(token: str) -> bool:
         print(f"\n=== Validating Token ===")
         print(f"Validating token: {token}")
         
-        check_redis_connection()
+        await check_redis_connection()
         
-        for key in redis_client.scan_iter("yas_token:*"):
-            print(f"Checking key: {key}")
-            token_data = redis_client.get(key)
-            if token_data:
-                try:
-                    data = json.loads(token_data)
-                    print(f"Found token data: {json.dumps(data, indent=2)}")
-                    if data.get('token') == token:
-                        print("Token validated successfully")
-                        return True
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing token data for key {key}: {str(e)}")
-                    print(f"Invalid token data: {token_data}")
-                    continue
+        if await find_token_data(token):
+            print("Token validated successfully")
+            return True
         
         print("Token validation failed")
         return False
+    except HTTPException:
+        # Redis unavailable (503) from check_redis_connection
+        raise
     except redis.RedisError as e:
+        redis_health.record_failure(e)
         print(f"Redis error during token validation: {str(e)}")
         return False
     except Exception as e:
@@ -327,7 +411,7 @@ def validate_token(token: str) -> bool:
         print(f"Stack trace: {traceback.format_exc()}")
         return False
 
-def decode_token(token: str) -> dict:
+async def decode_token(token: str) -> dict:
     """
     Decode token and return associated data from Redis
     """
@@ -335,30 +419,22 @@ def decode_token(token: str) -> dict:
         print(f"\n=== Decoding Token ===")
         print(f"Decoding token: {token}")
         
-        check_redis_connection()
+        await check_redis_connection()
         
-        for key in redis_client.scan_iter("yas_token:*"):
-            print(f"Checking key: {key}")
-            token_data = redis_client.get(key)
-            if token_data:
-                try:
-                    data = json.loads(token_data)
-                    if data.get('token') == token:
-                        print(f"Found token data: {json.dumps(data, indent=2)}")
-                        return {
-                            'user_id': data['systemUserId'],
-                            'tenant_id': data['tenantId'],
-                            'expiration_time': data['expirationTime'],
-                            'taxpayer_no': data.get('taxpayerNo')
-                        }
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing token data for key {key}: {str(e)}")
-                    print(f"Invalid token data: {token_data}")
-                    continue
+        data = await find_token_data(token)
+        if data:
+            print(f"Found token data: {json.dumps(data, indent=2)}")
+            return {
+                'user_id': data['systemUserId'],
+                'tenant_id': data['tenantId'],
+                'expiration_time': data['expirationTime'],
+                'taxpayer_no': data.get('taxpayerNo')
+            }
         
         print("Token not found in Redis")
         raise HTTPException(status_code=401, detail="Invalid token")
     except redis.RedisError as e:
+        redis_health.record_failure(e)
         print(f"Redis error during token decoding: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Redis error: {str(e)}")
     except HTTPException:
@@ -368,7 +444,7 @@ def decode_token(token: str) -> dict:
         print(f"Stack trace: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error decoding token: {str(e)}")
 
-def clear_user_token(user_id: int) -> bool:
+async def clear_user_token(user_id: int) -> bool:
     """
     Clear user's token from Redis
     """
@@ -376,10 +452,17 @@ def clear_user_token(user_id: int) -> bool:
         print(f"\n=== Clearing User Token ===")
         print(f"Clearing token for user_id: {user_id}")
         
-        check_redis_connection()
+        await check_redis_connection()
         
-        redis_key = f"yas_token:{user_id}"
-        result = redis_client.delete(redis_key)
+        redis_keys = [token_key(user_id), registration_key_for(user_id)]
+        data = await get_token_data(user_id)
+        if data and data.get('token'):
+            redis_keys.append(token_index_key(data['token']))
+        token_cache.pop(str(user_id))
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.delete(*redis_keys)
+            pipe.zrem(TOKEN_EXPIRY_KEY, str(user_id))
+            result, _ = await pipe.execute()
         
         if result:
             print("Token cleared successfully")
@@ -388,6 +471,7 @@ def clear_user_token(user_id: int) -> bool:
         print("No token found to clear")
         return False
     except redis.RedisError as e:
+        redis_health.record_failure(e)
         print(f"Redis error clearing token: {str(e)}")
         return False
     except Exception as e:
@@ -1,44 +1,56 @@
-from sqlalchemy.orm import Session, contains_eager
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, undefer
+from sqlalchemy import func, select
 from models import Channel, User, CompanyReport, ReportTransaction, CompanyInfo
+from services.db_routing import mark_user_write
+from utils.pagination import keyset_page, page_envelope
 from typing import List, Optional
 from datetime import datetime
 
-def get_channel_by_id(db: Session, channel_id: int) -> Optional[Channel]:
-    return db.query(Channel).filter(Channel.id == channel_id).first()
+async def get_channel_by_id(db: AsyncSession, channel_id: int) -> Optional[Channel]:
+    return await db.scalar(select(Channel).where(Channel.id == channel_id))
 
-def get_channel_by_number(db: Session, channel_number: str) -> Optional[Channel]:
-    return db.query(Channel).filter(Channel.channel_number == channel_number).first()
+async def get_channel_by_number(db: AsyncSession, channel_number: str) -> Optional[Channel]:
+    return await db.scalar(select(Channel).where(Channel.channel_number == channel_number))
 
-def get_channel_users(db: Session, channel_id: int) -> List[User]:
-    return db.query(User).filter(User.channel_id == channel_id).all()
+async def get_channel_users(db: AsyncSession, channel_id: int) -> List[User]:
+    return (await db.scalars(select(User).where(User.channel_id == channel_id))).all()
 
-def get_channel_second_level_users(db: Session, channel_id: int) -> List[User]:
-    return db.query(User).filter(
+async def get_channel_second_level_users(db: AsyncSession, channel_id: int) -> List[User]:
+    return (await db.scalars(select(User).where(
         User.channel_id == channel_id,
         User.role == "level_2"
-    ).all()
+    ))).all()
+
+def latest_company_info_id():
+    """
+    Id of the newest company_info row of a report's tax number, as a
+    correlated subquery. Joining on tax_number alone returns a row per
+    upload of the company, which breaks pagination.
+    """
+    return (
+        select(func.max(CompanyInfo.id))
+        .where(CompanyInfo.tax_number == CompanyReport.company_tax_number)
+        .correlate(CompanyReport)
+        .scalar_subquery()
+    )
 
-def get_channel_reports(db: Session, channel_id: int) -> List[dict]:
+async def get_channel_reports(db: AsyncSession, channel_id: int, cursor: str = None, page_size: int = None) -> dict:
     # Get all users belonging to this channel
-    channel_users = db.query(User.id).filter(User.channel_id == channel_id).subquery()
+    channel_users = select(User.id).where(User.channel_id == channel_id).subquery()
     
-    # Get all reports processed by these users, including company info
-    reports = (
-        db.query(CompanyReport, CompanyInfo)
+    # Get one page of the reports processed by these users, including company info
+    reports = (await db.execute(keyset_page(
+        select(CompanyReport, CompanyInfo)
         .join(channel_users, CompanyReport.processed_by_user_id == channel_users.c.id)
-        .join(
-            CompanyInfo,
-            CompanyReport.company_tax_number == CompanyInfo.tax_number
-        )
-        .order_by(CompanyReport.created_at.desc())
-        .all()
-    )
+        .join(CompanyInfo, CompanyInfo.id == latest_company_info_id()),
+        CompanyReport.created_at, CompanyReport.id, cursor, page_size
+    ))).all()
     
     # Format the results
-    formatted_reports = []
-    for report, company_info in reports:
-        formatted_reports.append({
+    def format_report(row):
+        report, company_info = row
+        return {
             'id': report.id,
             'report_type': report.report_type,
             'year': report.year,
@@ -55,25 +67,25 @@ def get_channel_reports(db: Session, channel_id: int) -> List[dict]:
             'processed_by_user': {
                 'id': report.processed_by_user_id
             }
-        })
+        }
     
-    return formatted_reports
+    return page_envelope(reports, page_size, key=lambda row: (row[0].created_at, row[0].id), serialize=format_report)
 
-def get_report_details(db: Session, report_id: int, user_channel_id: int) -> Optional[dict]:
+async def get_report_details(db: AsyncSession, report_id: int, user_channel_id: int) -> Optional[dict]:
     # Get the report with company info and verify it belongs to the channel
-    result = (
-        db.query(CompanyReport, CompanyInfo, User)
+    result = (await db.execute(
+        select(CompanyReport, CompanyInfo, User)
         .join(User, CompanyReport.processed_by_user_id == User.id)
         .join(
             CompanyInfo,
             CompanyReport.company_tax_number == CompanyInfo.tax_number
         )
-        .filter(
+        .where(
             CompanyReport.id == report_id,
             User.channel_id == user_channel_id
         )
-        .first()
-    )
+        .options(undefer(CompanyReport.report_data))
+    )).first()
     
     if not result:
         return None
@@ -101,36 +113,41 @@ def get_report_details(db: Session, report_id: int, user_channel_id: int) -> Opt
         }
     }
 
-def get_user_reports(db: Session, user_id: int) -> List[CompanyReport]:
-    return (
-        db.query(CompanyReport)
-        .filter(CompanyReport.processed_by_user_id == user_id)
+async def get_user_reports(db: AsyncSession, user_id: int, cursor: str = None, page_size: int = None) -> dict:
+    reports = (await db.scalars(keyset_page(
+        select(CompanyReport)
+        .where(CompanyReport.processed_by_user_id == user_id)
         .join(
             CompanyInfo,
-            CompanyReport.company_tax_number == CompanyInfo.tax_number,
+            CompanyInfo.id == latest_company_info_id(),
             isouter=True  # Use left outer join
         )
         .options(
             contains_eager(CompanyReport.company_info)
-        )
-        .order_by(CompanyReport.created_at.desc())
-        .all()
-    )
+        ),
+        CompanyReport.created_at, CompanyReport.id, cursor, page_size
+    ))).all()
+    return page_envelope(reports, page_size)
 
-def get_channel_transactions(db: Session, channel_id: int) -> List[ReportTransaction]:
-    return db.query(ReportTransaction).filter(
+async def get_channel_transactions(db: AsyncSession, channel_id: int, limit: int = None) -> List[ReportTransaction]:
+    query = select(ReportTransaction).where(
         ReportTransaction.channel_id == channel_id
-    ).order_by(ReportTransaction.created_at.desc()).all()
+    ).order_by(ReportTransaction.created_at.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return (await db.scalars(query)).all()
 
-def get_channel_statistics(db: Session, channel_id: int) -> dict:
+async def get_channel_statistics(db: AsyncSession, channel_id: int) -> dict:
     # Get upload and download counts
-    transactions = db.query(
-        ReportTransaction.transaction_type,
-        func.count(ReportTransaction.id).label('count'),
-        func.sum(ReportTransaction.cost).label('total_cost')
-    ).filter(
-        ReportTransaction.channel_id == channel_id
-    ).group_by(ReportTransaction.transaction_type).all()
+    transactions = (await db.execute(
+        select(
+            ReportTransaction.transaction_type,
+            func.count(ReportTransaction.id).label('count'),
+            func.sum(ReportTransaction.cost).label('total_cost')
+        ).where(
+            ReportTransaction.channel_id == channel_id
+        ).group_by(ReportTransaction.transaction_type)
+    )).all()
 
     stats = {
         'total_uploads': 0,
@@ -147,15 +164,15 @@ def get_channel_statistics(db: Session, channel_id: int) -> dict:
 
     return stats
 
-def get_channel_dashboard_data(db: Session, channel_id: int) -> dict:
-    channel = get_channel_by_id(db, channel_id)
+async def get_channel_dashboard_data(db: AsyncSession, channel_id: int, page_size: int = None) -> dict:
+    channel = await get_channel_by_id(db, channel_id)
     if not channel:
         return None
 
-    second_level_users = get_channel_second_level_users(db, channel_id)
-    reports = get_channel_reports(db, channel_id)
-    recent_transactions = get_channel_transactions(db, channel_id)[:10]  # Get last 10 transactions
-    statistics = get_channel_statistics(db, channel_id)
+    second_level_users = await get_channel_second_level_users(db, channel_id)
+    reports = await get_channel_reports(db, channel_id, page_size=page_size)  # First page, more via /api/channel/reports
+    recent_transactions = await get_channel_transactions(db, channel_id, limit=10)  # Get last 10 transactions
+    statistics = await get_channel_statistics(db, channel_id)
 
     return {
         'channel': channel,
@@ -165,14 +182,14 @@ def get_channel_dashboard_data(db: Session, channel_id: int) -> dict:
         **statistics
     }
 
-def get_level2_user_reports_data(db: Session, user_id: int) -> dict:
+async def get_level2_user_reports_data(db: AsyncSession, user_id: int, cursor: str = None, page_size: int = None) -> dict:
     # Get the user with their channel information
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user or user.role != "level_2":
         return None
 
-    # Get the user's reports with company info
-    reports = get_user_reports(db, user_id)
+    # Get one page of the user's reports with company info
+    reports = await get_user_reports(db, user_id, cursor, page_size)
 
     # Convert to dictionary format
     return {
@@ -185,32 +202,35 @@ def get_level2_user_reports_data(db: Session, user_id: int) -> dict:
             'role': user.role,
             'channel_id': user.channel_id
         },
-        'reports': [{
-            'id': report.id,
-            'report_type': report.report_type,
-            'year': report.year,
-            'month': report.month,
-            'quarter': report.quarter,
-            'created_at': report.created_at.isoformat() if report.created_at else None,
-            'company_info': {
-                'company_name': report.company_info.company_name if report.company_info else 'Unknown Company',
-                'tax_number': report.company_tax_number
-            }
-        } for report in reports]
+        'reports': {
+            **reports,
+            'items': [{
+                'id': report.id,
+                'report_type': report.report_type,
+                'year': report.year,
+                'month': report.month,
+                'quarter': report.quarter,
+                'created_at': report.created_at.isoformat() if report.created_at else None,
+                'company_info': {
+                    'company_name': report.company_info.company_name if report.company_info else 'Unknown Company',
+                    'tax_number': report.company_tax_number
+                }
+            } for report in reports['items']]
+        }
     }
 
-def update_channel_balance(db: Session, channel_id: int, amount: float) -> Optional[Channel]:
-    channel = get_channel_by_id(db, channel_id)
+async def update_channel_balance(db: AsyncSession, channel_id: int, amount: float) -> Optional[Channel]:
+    channel = await get_channel_by_id(db, channel_id)
     if not channel:
         return None
     
     channel.balance += amount
-    db.commit()
-    db.refresh(channel)
+    await db.commit()
+    await db.refresh(channel)
     return channel
 
-def create_report_transaction(
-    db: Session,
+async def create_report_transaction(
+    db: AsyncSession,
     user_id: int,
     channel_id: int,
     report_id: int,
@@ -226,6 +246,7 @@ def create_report_transaction(
         created_at=datetime.utcnow()
     )
     db.add(transaction)
-    db.commit()
-    db.refresh(transaction)
+    await db.commit()
+    await db.refresh(transaction)
+    await mark_user_write(user_id)
     return transaction
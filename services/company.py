@@ -1,20 +1,73 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+import time
+import asyncio
+import hashlib
 import traceback
 from typing import List
 import httpx
-from fastapi import HTTPException, UploadFile
-from sqlalchemy.orm import Session
-from redis import Redis
+import redis
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
+from sqlalchemy.orm import undefer
 from models import User, CompanyInfo, CompanyReport
-from services.auth import get_cached_token, validate_token, get_cached_tin
+from services.auth import get_cached_token, validate_token, get_cached_tin, find_token_data, check_redis_connection, get_registration_data
+from services.redis_client import get_redis, acquire_lock, release_lock, extend_lock
+from services.redis_health import redis_health
+from services.http_client import get_http_client, endpoint_timeout, endpoint_url
+from services.resilience import call_upstream
+from services.db_routing import mark_user_write
+from services.spreadsheet_validation import validate_upload_files
+from config import settings
+from utils.metrics import metrics
+from utils.single_flight import SingleFlight
+
+def file_content_hashes(files: List[tuple]) -> List[str]:
+    """
+    SHA-256 of each (filename, file object, content type) upload.
+    Reads each file object in chunks and rewinds it afterwards.
+    """
+    file_hashes = []
+    for _, fileobj, _ in files:
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: fileobj.read(settings.UPLOAD_COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        fileobj.seek(0)
+        file_hashes.append(digest.hexdigest())
+    return file_hashes
+
+def upload_fingerprint(tin: str, date_source: int, date_type: int, year: int, file_hashes: List[str]) -> str:
+    """
+    SHA-256 over the upload parameters and the sorted content hashes of the
+    files, so the same set of files fingerprints the same in any order
+    """
+    fingerprint = hashlib.sha256(f"{tin}|{date_source}|{date_type}|{year}".encode())
+    for file_hash in sorted(file_hashes):
+        fingerprint.update(file_hash.encode())
+    return fingerprint.hexdigest()
 
-# Initialize Redis client
-redis_client = Redis(host='localhost', port=6379, db=0)
+async def find_previous_upload(db: AsyncSession, fingerprint: str):
+    """
+    Most recent successful upload with the given fingerprint, or None
+    """
+    return (
+        await db.scalar(
+            select(CompanyInfo)
+            .where(CompanyInfo.upload_fingerprint == fingerprint, CompanyInfo.status == True)
+            .order_by(CompanyInfo.id.desc())
+            .limit(1)
+        )
+    )
 
-async def upload_company_info_batch(db: Session, system_user_id: int, user_id: int, date_source: int, date_type: int, year: int, files: List[UploadFile]):
+async def upload_company_info_batch(db: AsyncSession, system_user_id: int, user_id: int, date_source: int, date_type: int, year: int, files: List[tuple], timings: dict = None):
     """
-    Upload company information files in batch to external API and store parameters in Redis
+    Upload company information files in batch to external API and store parameters in Redis.
+    files holds (filename, file object, content type) tuples. Pass open
+    files, not their contents: httpx then streams each one into the multipart
+    body in chunks instead of holding the whole batch in memory. When a timings dict is
+    passed, the times the request was sent and answered are recorded in it.
     """
     print("\n in service/company.py upload_company_info_batch")
     try:
@@ -26,7 +79,7 @@ async def upload_company_info_batch(db: Session, system_user_id: int, user_id: i
         print(f"Files Count: {len(files)}")
         
         # Verify user exists in database
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user:
             error_msg = f"User with ID {user_id} not found in database"
             print(f"Error: {error_msg}")
@@ -35,14 +88,14 @@ async def upload_company_info_batch(db: Session, system_user_id: int, user_id: i
 
         # Get and validate token
         print("\nChecking token...")
-        token = get_cached_token(system_user_id)
+        token = await get_cached_token(system_user_id)
         if not token:
             error_msg = "Token not found. Please login first."
             print(f"Error: {error_msg}")
             raise HTTPException(status_code=401, detail=error_msg)
 
         # Get TIN from Redis
-        tin = get_cached_tin(system_user_id)
+        tin = await get_cached_tin(system_user_id)
         if not tin:
             error_msg = "Taxpayer number not found. Please register first."
             print(f"Error: {error_msg}")
@@ -50,25 +103,48 @@ async def upload_company_info_batch(db: Session, system_user_id: int, user_id: i
 
         print(f"Found token and TIN for user {user_id}")
         print("\nValidating token...")
-        if not validate_token(token):
+        if not await validate_token(token):
             error_msg = "Invalid or expired token. Please login again."
             print(f"Error: {error_msg}")
             raise HTTPException(status_code=401, detail=error_msg)
 
         print("Token validation successful")
 
+        # Skip the third-party import if this exact set of files was already
+        # accepted for the same taxpayer and period
+        file_hashes = await run_in_threadpool(file_content_hashes, files)
+        fingerprint = upload_fingerprint(tin, date_source, date_type, year, file_hashes)
+        previous_upload = await find_previous_upload(db, fingerprint)
+        if previous_upload:
+            print(f"Identical upload already accepted as CompanyInfo ID {previous_upload.id}, skipping external API")
+            metrics.inc("upload_dedup_total", result="hit")
+            return {
+                "status": 200,
+                "message": previous_upload.query_result,
+                "timestamp": datetime.now().isoformat(),
+                "company_info_id": previous_upload.id,
+                "duplicate": True,
+                "uploaded_at": previous_upload.created_at.isoformat() if previous_upload.created_at else None
+            }
+        metrics.inc("upload_dedup_total", result="miss")
+
+        # Reject files that don't match the year and period before the
+        # multi-minute third-party import
+        rejected = await validate_upload_files(files, file_hashes, year, date_type)
+        if rejected:
+            error_msg = "; ".join(
+                f"file {index + 1} ({filename}): {', '.join(errors)}" for (index, filename), errors in rejected.items()
+            )
+            print(f"Rejected upload files: {error_msg}")
+            raise HTTPException(status_code=400, detail=f"Invalid upload files - {error_msg}")
+
         # Prepare the files for upload
-        files_data = []
-        filenames = []  # Store filenames for the company record
-        for file in files:
-            file_content = await file.read()
-            files_data.append(('files', (file.filename, file_content, file.content_type)))
-            filenames.append(file.filename)
-            await file.seek(0)  # Reset file position after reading
+        files_data = [('files', (filename, fileobj, content_type)) for filename, fileobj, content_type in files]
+        filenames = [filename for filename, _, _ in files]  # Store filenames for the company record
 
         # Prepare the API request headers and parameters
         print("\n=== Preparing API Request ===")
-        base_url = "http://test-yas.hthuiyou.com/skServer/yas/getexcel/data-impcal"
+        base_url = endpoint_url('upload')
         params = {
             'dateSource': str(date_source),
             'dateType': str(date_type),
@@ -82,121 +158,130 @@ async def upload_company_info_batch(db: Session, system_user_id: int, user_id: i
         full_url = f"{base_url}?{query_string}"
         print(f"Full URL: {full_url}")
         print(f"Parameters: {json.dumps(params, indent=2)}")
-        print(f"Files: {[file.filename for file in files]}")
+        print(f"Files: {filenames}")
         print(f"Headers: {json.dumps({k: v[:10] + '...' if k == 'token' else v for k, v in headers.items()}, indent=2)}")
 
         # Make request to the external API with increased timeout
-        timeout = httpx.Timeout(201.0, connect=60.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            print("\n=== Sending Request to External API ===")
-            try:
-                response = await client.post(
+        timeout = endpoint_timeout('upload')
+        client = get_http_client()
+        print("\n=== Sending Request to External API ===")
+        try:
+            async def send():
+                # Rewind the files in case an earlier attempt read from them
+                for _, fileobj, _ in files:
+                    fileobj.seek(0)
+                if timings is not None:
+                    timings['sent_at'] = time.time()
+                return await client.post(
                     base_url,
                     params=params,
                     files=files_data,
                     headers=headers,
                     timeout=timeout
                 )
-                print(f"Response Status Code: {response.status_code}")
-                print(f"Response Headers: {dict(response.headers)}")
-                print(f"Request URL: {response.request.url}")
-
-                # Log raw response text first
-                raw_response = response.text
-                print(f"Raw Response Text: {raw_response}")
-
-                # Check if response is empty
-                if not raw_response:
-                    print("Empty response received from API")
-                    raise HTTPException(
-                        status_code=500,
-                        detail="Empty response received from API"
-                    )
 
-                try:
-                    response_data = response.json()
-                    print(f"Parsed Response Data: {json.dumps(response_data, indent=2)}")
-                except json.JSONDecodeError as e:
-                    print(f"JSON Parse Error: {str(e)}")
-                    print(f"Failed to parse response: {raw_response}")
-                    error_msg = raw_response if raw_response else "Invalid JSON response from API"
-                    raise HTTPException(
-                        status_code=500,
-                        detail=error_msg
-                    )
-
-                # Check if the response status is 200 (success)
-                if response_data.get('status') != 200:
-                    error_msg = response_data.get('msg', 'Upload failed')
-                    print(f"API Error: {error_msg}")
-                    raise HTTPException(status_code=400, detail=error_msg)
-
-                # Store upload parameters in Redis for later use
-                print("\n=== Storing Upload Parameters in Redis ===")
-                upload_params = {
-                    "dateSource": date_source,
-                    "dateType": date_type,
-                    "year": year,
-                    "taxpayerNo": tin,
-                    "timestamp": datetime.now().isoformat()
-                }
-                redis_key = f"upload_params:{user_id}"
-                redis_client.set(redis_key, json.dumps(upload_params))
-                print(f"Stored upload parameters: {json.dumps(upload_params, indent=2)}")
-
-                # Get company registration info from Redis
-                company_reg_key = f"company_registration:{system_user_id}"
-                company_reg_data = redis_client.get(company_reg_key)
-                if company_reg_data:
-                    company_reg = json.loads(company_reg_data)
-                else:
-                    company_reg = {}
-
-                # Create single CompanyInfo record with all files
-                print("\n=== Creating CompanyInfo Record ===")
-                try:
-                    company_info = CompanyInfo(
-                        company_name=company_reg.get('companyName', ''),
-                        tax_number=tin,
-                        index_standard_type=company_reg.get('indexStandardType', ''),
-                        industry=company_reg.get('industry', ''),
-                        registration_type=company_reg.get('registrationType', ''),
-                        taxpayer_nature=company_reg.get('taxpayerNature', ''),
-                        upload_year=year,
-                        uploaded_files=filenames,
-                        post_data=json.dumps(upload_params),
-                        post_initiator_user_id=user.id,
-                        status=True
-                    )
-                    db.add(company_info)
-                    db.commit()
-                    db.refresh(company_info)
-                    print(f"Created CompanyInfo record with ID: {company_info.id}")
-                except Exception as e:
-                    db.rollback()
-                    print(f"Error creating CompanyInfo record: {str(e)}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Failed to create CompanyInfo record: {str(e)}"
-                    )
-
-                # Return the response data
-                return {
-                    "status": response_data.get('status'),
-                    "message": response_data.get('msg'),
-                    "timestamp": datetime.now().isoformat(),
-                    "company_info_id": company_info.id
-                }
-
-            except httpx.TimeoutException:
-                error_msg = "Request to external API timed out (120s limit)"
-                print(f"Error: {error_msg}")
-                raise HTTPException(status_code=504, detail=error_msg)
-
-            except httpx.RequestError as e:
-                error_msg = f"Error connecting to external API: {str(e)}"
-                print(f"Error: {error_msg}")
-                raise HTTPException(status_code=502, detail=error_msg)
+            # The import is not idempotent, so only failures to connect are retried
+            response = await call_upstream('upload', send, idempotent=False)
+            if timings is not None:
+                timings['responded_at'] = time.time()
+            print(f"Response Status Code: {response.status_code}")
+            print(f"Response Headers: {dict(response.headers)}")
+            print(f"Request URL: {response.request.url}")
+
+            # Log raw response text first
+            raw_response = response.text
+            print(f"Raw Response Text: {raw_response}")
+
+            # Check if response is empty
+            if not raw_response:
+                print("Empty response received from API")
+                raise HTTPException(
+                    status_code=500,
+                    detail="Empty response received from API"
+                )
+
+            try:
+                response_data = response.json()
+                print(f"Parsed Response Data: {json.dumps(response_data, indent=2)}")
+            except json.JSONDecodeError as e:
+                print(f"JSON Parse Error: {str(e)}")
+                print(f"Failed to parse response: {raw_response}")
+                error_msg = raw_response if raw_response else "Invalid JSON response from API"
+                raise HTTPException(
+                    status_code=500,
+                    detail=error_msg
+                )
+
+            # Check if the response status is 200 (success)
+            if response_data.get('status') != 200:
+                error_msg = response_data.get('msg', 'Upload failed')
+                print(f"API Error: {error_msg}")
+                raise HTTPException(status_code=400, detail=error_msg)
+
+            # Store upload parameters in Redis for later use
+            print("\n=== Storing Upload Parameters in Redis ===")
+            upload_params = {
+                "dateSource": date_source,
+                "dateType": date_type,
+                "year": year,
+                "taxpayerNo": tin,
+                "timestamp": datetime.now().isoformat()
+            }
+            redis_key = f"upload_params:{user_id}"
+            await get_redis().setex(redis_key, settings.UPLOAD_PARAMS_TTL_SECONDS, json.dumps(upload_params))
+            print(f"Stored upload parameters: {json.dumps(upload_params, indent=2)}")
+
+            # Get company registration info from Redis
+            company_reg = await get_registration_data(system_user_id)
+
+            # Create single CompanyInfo record with all files
+            print("\n=== Creating CompanyInfo Record ===")
+            try:
+                company_info = CompanyInfo(
+                    company_name=company_reg.get('companyName', ''),
+                    tax_number=tin,
+                    index_standard_type=company_reg.get('indexStandardType', ''),
+                    industry=company_reg.get('industry', ''),
+                    registration_type=company_reg.get('registrationType', ''),
+                    taxpayer_nature=company_reg.get('taxpayerNature', ''),
+                    upload_year=year,
+                    uploaded_files=filenames,
+                    post_data=json.dumps(upload_params),
+                    post_initiator_user_id=user.id,
+                    status=True,
+                    query_result=(response_data.get('msg') or '')[:225],
+                    upload_fingerprint=fingerprint
+                )
+                db.add(company_info)
+                await db.commit()
+                await db.refresh(company_info)
+                await mark_user_write(user_id)
+                print(f"Created CompanyInfo record with ID: {company_info.id}")
+            except Exception as e:
+                await db.rollback()
+                print(f"Error creating CompanyInfo record: {str(e)}")
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to create CompanyInfo record: {str(e)}"
+                )
+
+            # Return the response data
+            return {
+                "status": response_data.get('status'),
+                "message": response_data.get('msg'),
+                "timestamp": datetime.now().isoformat(),
+                "company_info_id": company_info.id
+            }
+
+        except httpx.TimeoutException:
+            error_msg = "Request to external API timed out (120s limit)"
+            print(f"Error: {error_msg}")
+            raise HTTPException(status_code=504, detail=error_msg)
+
+        except httpx.RequestError as e:
+            error_msg = f"Error connecting to external API: {str(e)}"
+            print(f"Error: {error_msg}")
+            raise HTTPException(status_code=502, detail=error_msg)
 
     except HTTPException as he:
         print(f"\nHTTP Exception occurred: {str(he)}")
@@ -210,206 +295,415 @@ async def upload_company_info_batch(db: Session, system_user_id: int, user_id: i
             detail=f"Internal server error during company info upload: {str(e)}"
         )
 
-async def query_third_party_system(db: Session, date_source: int, date_time: str, date_type: int, year: int, token: str, current_user: User, report_type: str = None):
+def report_period(report_type: str, date_time) -> int:
     """
-    Query third party system for company information and store the report
+    Month or quarter number of a monthly/quarterly report, None for annual
     """
-    print("\n=== Starting Third Party System Query ===")
+    if report_type in ('monthly', 'quarterly'):
+        return int(date_time) if date_time else 0
+    return None
+
+def report_lookup_query(tin: str, report_type: str, year: int, period: int = None):
+    """
+    Select of the stored report of a taxpayer and period. Served by the
+    ix_company_reports_lookup index.
+    """
+    query = select(CompanyReport).where(
+        CompanyReport.company_tax_number == tin,
+        CompanyReport.report_type == report_type,
+        CompanyReport.year == year
+    )
+
+    # Add period-specific filters based on report type
+    if report_type == 'monthly':
+        query = query.where(CompanyReport.month == period)
+    elif report_type == 'quarterly':
+        query = query.where(CompanyReport.quarter == period)
+    return query
+
+async def database_now(db: AsyncSession) -> datetime:
+    """
+    Current time on the database clock, the one behind the created_at and
+    updated_at defaults. The app's clock may be in another time zone.
+    """
+    return await db.scalar(select(func.now()))
+
+async def find_fresh_report(db: AsyncSession, tin: str, report_type: str, year: int, period: int = None):
+    """
+    Stored report for the taxpayer and period that is younger than
+    REPORT_CACHE_MAX_AGE_SECONDS, or None
+    """
+    if settings.REPORT_CACHE_MAX_AGE_SECONDS <= 0:
+        return None
+    cutoff = await database_now(db) - timedelta(seconds=settings.REPORT_CACHE_MAX_AGE_SECONDS)
+    last_stored = func.coalesce(CompanyReport.updated_at, CompanyReport.created_at)
+    return await db.scalar(
+        report_lookup_query(tin, report_type, year, period)
+        .where(last_stored >= cutoff)
+        .order_by(last_stored.desc())
+        .options(undefer(CompanyReport.report_data))
+        .limit(1)
+    )
+
+def build_report_params(tin: str, date_source: int, date_time, date_type: int, year: int, report_type: str) -> dict:
+    """
+    ow-data request parameters for a taxpayer and period
+    """
+    # Convert parameters to strings and ensure they're not None
+    params = {
+        'dateSource': str(date_source) if date_source is not None else '0',
+        'dateType': str(date_type) if date_type is not None else '0',
+        'year': str(year) if year is not None else str(datetime.now().year),
+        'taxpayerNo': tin,  # Include TIN in API request
+        'reportType': report_type or 'annual'  # Include report type
+    }
+
+    # Set dateTime based on report type
+    if report_type == 'quarterly':
+        params['dateTime'] = str(date_time)  # Quarter value (1-4)
+        params['quarter'] = str(date_time)
+    elif report_type == 'monthly':
+        params['dateTime'] = str(date_time)  # Month value (1-12)
+        params['month'] = str(date_time)
+    else:  # annual
+        params['dateTime'] = '0'
+    return params
+
+async def fetch_report(params: dict, token: str) -> dict:
+    """
+    Call the third-party ow-data endpoint and return its parsed response
+    """
+    base_url = endpoint_url('query')
+
+    # Add token to headers
+    headers = {
+        'token': token,
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+
+    # Log request details
+    print("\n=== Preparing API Request ===")
+    print(f"Base URL: {base_url}")
+    print(f"Parameters: {json.dumps(params, indent=2)}")
+    print(f"Headers: {json.dumps({k: v[:10] + '...' if k == 'token' else v for k, v in headers.items()}, indent=2)}")
+
+    # Make request to the external API with increased timeout
+    timeout = endpoint_timeout('query')
+    client = get_http_client()
+    try:
+        response = await call_upstream(
+            'query',
+            lambda: client.post(
+                base_url,
+                json=params,
+                headers=headers,
+                timeout=timeout
+            ),
+            idempotent=True
+        )
+        print(f"Response Status Code: {response.status_code}")
+        print(f"Response Headers: {dict(response.headers)}")
+
+        # Log raw response text
+        raw_response = response.text
+        print(f"Raw Response Text: {raw_response}")
+
+        # Check if response is empty
+        if not raw_response:
+            print("Empty response received from API")
+            raise HTTPException(
+                status_code=500,
+                detail="Empty response received from API"
+            )
+
+        try:
+            response_data = response.json()
+            print(f"Parsed Response Data: {json.dumps(response_data, indent=2)}")
+        except json.JSONDecodeError as e:
+            print(f"JSON Parse Error: {str(e)}")
+            print(f"Failed to parse response: {raw_response}")
+            error_msg = raw_response if raw_response else "Invalid JSON response from API"
+            raise HTTPException(
+                status_code=500,
+                detail=error_msg
+            )
+
+        # Check response status
+        if response_data.get('status') != 200:
+            error_msg = response_data.get('msg', 'Query failed')
+            print(f"API Error: {error_msg}")
+            raise HTTPException(status_code=400, detail=error_msg)
+
+        return response_data
+
+    except httpx.TimeoutException:
+        error_msg = "Request to external API timed out"
+        print(f"Error: {error_msg}")
+        raise HTTPException(status_code=504, detail=error_msg)
+
+    except httpx.RequestError as e:
+        error_msg = f"Error connecting to external API: {str(e)}"
+        print(f"Error: {error_msg}")
+        raise HTTPException(status_code=502, detail=error_msg)
+
+async def upsert_report(db: AsyncSession, tin: str, report_type: str, year: int, date_time, report_payload: dict, user_id: int) -> CompanyReport:
+    """
+    Insert or update the stored report for a taxpayer and period.
+    The caller commits.
+    """
+    # Get the time period from the response data or parameters
+    risk_main = (report_payload or {}).get('riskMain', {})
+    time_period = risk_main.get('dateTime')
+
+    if time_period is None:
+        time_period = int(date_time) if date_time else 0
+
+    print(f"Storing report of type {report_type} for period: {time_period}")
+
+    # Check if report already exists
+    existing_report = await db.scalar(report_lookup_query(tin, report_type, year, time_period).limit(1))
+
+    if existing_report:
+        # Update existing report
+        existing_report.report_data = report_payload
+        # Database clock, like created_at
+        existing_report.updated_at = func.now()
+        print(f"Updating existing report ID: {existing_report.id}")
+        return existing_report
+
+    # Create new report
+    new_report = CompanyReport(
+        processed_by_user_id=user_id,
+        company_tax_number=tin,
+        report_type=report_type,
+        year=year,
+        month=time_period if report_type == 'monthly' else None,
+        quarter=time_period if report_type == 'quarterly' else None,
+        report_data=report_payload
+    )
+    db.add(new_report)
+    print("Creating new report")
+    return new_report
+
+def stored_report_response(report: CompanyReport, cache: str) -> dict:
+    """
+    Response of query_third_party_system for a report served from the database
+    """
+    return {
+        "status": 200,
+        "msg": "success",
+        "data": report.report_data,
+        "timestamp": datetime.now().isoformat(),
+        "cache": cache,
+        "report_id": report.id,
+        "stored_at": (report.updated_at or report.created_at).isoformat()
+    }
+
+# Identical concurrent ow-data queries within this process share one call
+report_flights = SingleFlight()
+
+async def keep_lock(lock_key: str, lock_token: str):
+    """
+    Renew a report query lock until cancelled, so it cannot expire while
+    its holder is still waiting on the third party
+    """
+    ttl = settings.REPORT_QUERY_LOCK_TTL_SECONDS
+    while True:
+        await asyncio.sleep(ttl / 3)
+        try:
+            if not await extend_lock(lock_key, lock_token, ttl):
+                print(f"Lost report query lock {lock_key}")
+                return
+        except Exception as e:
+            redis_health.record_failure(e)
+            print(f"Error renewing report query lock {lock_key}: {str(e)}")
+            return
+
+async def fetch_without_lock(error: Exception, fetch_and_store):
+    """
+    Query without cross-worker coalescing after Redis failed; the lock only
+    saves duplicate work, so it must not fail the query
+    """
+    redis_health.record_failure(error)
+    print(f"Report query lock unavailable, querying without it: {str(error)}")
+    metrics.inc("report_query_lock_errors_total")
+    return await fetch_and_store()
+
+async def fetch_with_cluster_lock(flight_key: tuple, fetch_and_store, stored_version, load_stored):
+    """
+    Extend single-flight coalescing across workers with a Redis lock.
+    The lock holder calls fetch_and_store(). Other workers wait for the lock
+    to be released and then serve what the holder stored: load_stored(version)
+    returns the stored report if it changed from the stored_version() seen
+    before waiting. They fall back to their own call if the holder failed or
+    took longer than REPORT_QUERY_LOCK_WAIT_SECONDS, and when Redis fails.
+    """
+    if not redis_health.allow_request():
+        return await fetch_and_store()
+
+    lock_key = "report_query_lock:" + hashlib.sha1("|".join(map(str, flight_key)).encode()).hexdigest()
+    deadline = time.monotonic() + settings.REPORT_QUERY_LOCK_WAIT_SECONDS
     try:
-        # Validate token and get TIN
-        print("\n=== Validating Token ===")
-        print(f"Validating token: {token}")
-
-        print("\n=== Checking Redis Connection ===")
-        redis_client.ping()
-        print("Redis connection check successful")
-
-        # Get token data from Redis by scanning for the token
-        token_data = None
-        for key in redis_client.scan_iter("yas_token:*"):
-            print(f"111 Checking key: {key}")
-            token_data_str = redis_client.get(key)
-            if token_data_str:
+        version = await stored_version()
+    except redis.RedisError as e:
+        return await fetch_without_lock(e, fetch_and_store)
+    while True:
+        try:
+            lock_token = await acquire_lock(lock_key, settings.REPORT_QUERY_LOCK_TTL_SECONDS)
+        except redis.RedisError as e:
+            return await fetch_without_lock(e, fetch_and_store)
+        if lock_token:
+            renewal = asyncio.create_task(keep_lock(lock_key, lock_token))
+            try:
+                return await fetch_and_store()
+            finally:
+                renewal.cancel()
                 try:
-                    data = json.loads(token_data_str)
-                    print(f"Found token data: {json.dumps(data, indent=2)}")
-                    if data.get("token") == token:
-                        token_data = data
-                        break
-                except json.JSONDecodeError:
-                    continue
-
-        if not token_data:
-            error_msg = "Token data not found in Redis. Please login again."
-            print(f"Error: {error_msg}")
-            raise HTTPException(status_code=401, detail=error_msg)
+                    await release_lock(lock_key, lock_token)
+                except Exception as e:
+                    # The report is stored; the lock expires on its own
+                    redis_health.record_failure(e)
+                    print(f"Error releasing report query lock {lock_key}: {str(e)}")
+
+        print(f"Another worker is fetching {flight_key}, waiting for it")
+        timed_out = False
+        try:
+            while await get_redis().exists(lock_key):
+                if time.monotonic() >= deadline:
+                    timed_out = True
+                    break
+                await asyncio.sleep(settings.REPORT_QUERY_LOCK_POLL_SECONDS)
+        except redis.RedisError as e:
+            return await fetch_without_lock(e, fetch_and_store)
+        if timed_out:
+            return await fetch_and_store()
+
+        result = await load_stored(version)
+        if result:
+            metrics.inc("report_query_coalesced_total", scope="cluster")
+            return result
+
+async def taxpayer_for_token(token: str) -> str:
+    """
+    Validate a third-party token and return the taxpayer number it was issued for
+    """
+    print("\n=== Validating Token ===")
+    print(f"Validating token: {token}")
 
-        print("Token validated successfully")
+    await check_redis_connection()
 
-        tin = token_data.get('taxpayerNo')
-        if not tin:
-            error_msg = "Taxpayer number not found in token data. Please register first."
-            print(f"Error: {error_msg}")
-            raise HTTPException(status_code=401, detail=error_msg)
+    # Resolve the token record through the token -> systemUserId index
+    token_data = await find_token_data(token)
 
-        # Prepare the API request
-        base_url = "http://test-yas.hthuiyou.com/skServer/yas/risk-report/simplified/ow-data"
-        
-        # Convert parameters to strings and ensure they're not None
-        params = {
-            'dateSource': str(date_source) if date_source is not None else '0',
-            'dateType': str(date_type) if date_type is not None else '0',
-            'year': str(year) if year is not None else str(datetime.now().year),
-            'taxpayerNo': tin,  # Include TIN in API request
-            'reportType': report_type or 'annual'  # Include report type
-        }
+    if not token_data:
+        error_msg = "Token data not found in Redis. Please login again."
+        print(f"Error: {error_msg}")
+        raise HTTPException(status_code=401, detail=error_msg)
 
-        # Set dateTime based on report type
-        if report_type == 'quarterly':
-            params['dateTime'] = str(date_time)  # Quarter value (1-4)
-            params['quarter'] = str(date_time)
-        elif report_type == 'monthly':
-            params['dateTime'] = str(date_time)  # Month value (1-12)
-            params['month'] = str(date_time)
-        else:  # annual
-            params['dateTime'] = '0'
+    print("Token validated successfully")
+
+    tin = token_data.get('taxpayerNo')
+    if not tin:
+        error_msg = "Taxpayer number not found in token data. Please register first."
+        print(f"Error: {error_msg}")
+        raise HTTPException(status_code=401, detail=error_msg)
+    return tin
+
+async def query_third_party_system(db: AsyncSession, date_source: int, date_time: str, date_type: int, year: int, token: str, current_user: User, report_type: str = None, force_refresh: bool = False):
+    """
+    Query third party system for company information and store the report.
+    A stored report younger than REPORT_CACHE_MAX_AGE_SECONDS is returned
+    instead of calling the third party, unless force_refresh is set.
+    Concurrent identical queries share a single upstream call.
+    """
+    print("\n=== Starting Third Party System Query ===")
+    # load_stored() rolls the session back, which expires current_user
+    user_id = current_user.id
+    try:
+        tin = await taxpayer_for_token(token)
 
+        params = build_report_params(tin, date_source, date_time, date_type, year, report_type)
         print(f"Using report type: {report_type}")
         print(f"Using dateTime: {params['dateTime']}")
-        
-        # Add token to headers
-        headers = {
-            'token': token,
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
 
-        # Log request details
-        print("\n=== Preparing API Request ===")
-        print(f"Base URL: {base_url}")
-        print(f"Parameters: {json.dumps(params, indent=2)}")
-        print(f"Headers: {json.dumps({k: v[:10] + '...' if k == 'token' else v for k, v in headers.items()}, indent=2)}")
+        # Use the provided report_type or default to 'annual'
+        report_type = report_type or 'annual'
+        period = report_period(report_type, date_time)
 
-        # Make request to the external API with increased timeout
-        timeout = httpx.Timeout(60.0, connect=30.0)
-        async with httpx.AsyncClient(timeout=timeout, verify=False) as client:
-            try:
-                response = await client.post(
-                    base_url,
-                    json=params,
-                    headers=headers,
-                    timeout=timeout
-                )
-                print(f"Response Status Code: {response.status_code}")
-                print(f"Response Headers: {dict(response.headers)}")
+        # Serve a recently stored report without calling the third party
+        if not force_refresh:
+            cached_report = await find_fresh_report(db, tin, report_type, year, period)
+            if cached_report:
+                print(f"Serving stored report ID {cached_report.id} from cache")
+                metrics.inc("report_cache_total", result="hit")
+                return stored_report_response(cached_report, "hit")
+        metrics.inc("report_cache_total", result="bypass" if force_refresh else "miss")
 
-                # Log raw response text
-                raw_response = response.text
-                print(f"Raw Response Text: {raw_response}")
+        async def fetch_and_store():
+            response_data = await fetch_report(params, token)
 
-                # Check if response is empty
-                if not raw_response:
-                    print("Empty response received from API")
-                    raise HTTPException(
-                        status_code=500,
-                        detail="Empty response received from API"
-                    )
-
-                try:
-                    response_data = response.json()
-                    print(f"Parsed Response Data: {json.dumps(response_data, indent=2)}")
-                except json.JSONDecodeError as e:
-                    print(f"JSON Parse Error: {str(e)}")
-                    print(f"Failed to parse response: {raw_response}")
-                    error_msg = raw_response if raw_response else "Invalid JSON response from API"
-                    raise HTTPException(
-                        status_code=500,
-                        detail=error_msg
-                    )
-
-                # Check response status
-                if response_data.get('status') != 200:
-                    error_msg = response_data.get('msg', 'Query failed')
-                    print(f"API Error: {error_msg}")
-                    raise HTTPException(status_code=400, detail=error_msg)
-
-                # Store the report in the database
-                try:
-                    # Use the provided report_type or default to 'annual'
-                    report_type = report_type or 'annual'
-                    
-                    # Get the time period from the response data or parameters
-                    risk_main = response_data.get('data', {}).get('riskMain', {})
-                    time_period = risk_main.get('dateTime')
-                    
-                    if time_period is None:
-                        time_period = int(date_time) if date_time else 0
-
-                    print(f"Storing report of type {report_type} for period: {time_period}")
-
-                    # Check if report already exists
-                    query = db.query(CompanyReport).filter(
-                        CompanyReport.company_tax_number == tin,
-                        CompanyReport.report_type == report_type,
-                        CompanyReport.year == year
-                    )
-
-                    # Add period-specific filters based on report type
-                    if report_type == 'monthly':
-                        query = query.filter(CompanyReport.month == time_period)
-                    elif report_type == 'quarterly':
-                        query = query.filter(CompanyReport.quarter == time_period)
-
-                    existing_report = query.first()
-
-                    if existing_report:
-                        # Update existing report
-                        existing_report.report_data = response_data.get('data')
-                        existing_report.updated_at = datetime.now()
-                        print(f"Updating existing report ID: {existing_report.id}")
-                    else:
-                        # Create new report
-                        new_report = CompanyReport(
-                            user_id=current_user.id,
-                            company_tax_number=tin,
-                            report_type=report_type,
-                            year=year,
-                            month=time_period if report_type == 'monthly' else None,
-                            quarter=time_period if report_type == 'quarterly' else None,
-                            report_data=response_data.get('data')
-                        )
-                        db.add(new_report)
-                        print("Creating new report")
-
-                    # Commit the transaction
-                    db.commit()
-                    print("Successfully stored report in database")
+            # Store the report in the database
+            try:
+                await upsert_report(db, tin, report_type, year, date_time, response_data.get('data'), user_id)
+
+                # Commit the transaction
+                await db.commit()
+                await mark_user_write(user_id)
+                print("Successfully stored report in database")
+
+            except Exception as e:
+                await db.rollback()
+                print(f"Error storing report in database: {str(e)}")
+                print(f"Stack trace: {traceback.format_exc()}")
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to store report in database: {str(e)}"
+                )
 
-                except Exception as e:
-                    db.rollback()
-                    print(f"Error storing report in database: {str(e)}")
-                    print(f"Stack trace: {traceback.format_exc()}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Failed to store report in database: {str(e)}"
-                    )
-
-                return {
-                    "status": response_data.get('status'),
-                    "msg": response_data.get('msg'),
-                    "data": response_data.get('data'),
-                    "timestamp": datetime.now().isoformat()
-                }
-
-            except httpx.TimeoutException:
-                error_msg = "Request to external API timed out"
-                print(f"Error: {error_msg}")
-                raise HTTPException(status_code=504, detail=error_msg)
-
-            except httpx.RequestError as e:
-                error_msg = f"Error connecting to external API: {str(e)}"
-                print(f"Error: {error_msg}")
-                raise HTTPException(status_code=502, detail=error_msg)
+            return {
+                "status": response_data.get('status'),
+                "msg": response_data.get('msg'),
+                "data": response_data.get('data'),
+                "timestamp": datetime.now().isoformat(),
+                "cache": "miss"
+            }
+
+        # (id, last stored time) of the stored report. Compared with the
+        # values read back from the database, so neither the app's clock nor
+        # the second precision of the timestamps matter.
+        async def stored_version():
+            last_stored = func.coalesce(CompanyReport.updated_at, CompanyReport.created_at)
+            row = (await db.execute(
+                report_lookup_query(tin, report_type, year, period)
+                .with_only_columns(CompanyReport.id, last_stored)
+                .limit(1)
+            )).first()
+            return tuple(row) if row else None
+
+        async def load_stored(previous_version):
+            # End the current transaction so rows committed by another
+            # worker become visible
+            await db.rollback()
+            report = await db.scalar(
+                report_lookup_query(tin, report_type, year, period)
+                .options(undefer(CompanyReport.report_data))
+                .limit(1)
+            )
+            if not report or (report.id, report.updated_at or report.created_at) == previous_version:
+                # Nothing was stored while waiting
+                return None
+            return stored_report_response(report, "miss")
+
+        flight_key = (tin, report_type, params['year'], params['dateTime'], params['dateSource'], params['dateType'])
+        result, shared = await report_flights.do(
+            flight_key,
+            lambda: fetch_with_cluster_lock(flight_key, fetch_and_store, stored_version, load_stored)
+        )
+        if shared:
+            metrics.inc("report_query_coalesced_total", scope="process")
+            result = {**result, "coalesced": True}
+        return result
 
     except HTTPException as he:
         print(f"\nHTTP Exception occurred: {str(he)}")
@@ -422,3 +716,77 @@ async def query_third_party_system(db: Session, date_source: int, date_time: str
             status_code=500,
             detail=f"Internal server error during third party system query: {str(e)}"
         )
+
+# dateType the third party expects for each report type
+REPORT_DATE_TYPES = {'annual': 0, 'quarterly': 1, 'monthly': 2}
+
+async def prefetch_reports(db: AsyncSession, token: str, current_user: User, year: int, report_type: str, periods: List[int], date_source: int = 0, force_refresh: bool = False) -> dict:
+    """
+    Fetch the reports of several periods of one year concurrently, at most
+    REPORT_PREFETCH_CONCURRENCY at a time, and store them in one transaction.
+    Periods with a fresh stored report are skipped unless force_refresh is set.
+    Returns a summary of stored, cached and failed periods.
+    """
+    started = time.perf_counter()
+    tin = await taxpayer_for_token(token)
+    date_type = REPORT_DATE_TYPES[report_type]
+
+    cached = []
+    to_fetch = []
+    for period in periods:
+        if not force_refresh and await find_fresh_report(db, tin, report_type, year, report_period(report_type, period)):
+            cached.append(period)
+        else:
+            to_fetch.append(period)
+    metrics.inc("report_cache_total", len(cached), result="hit")
+    metrics.inc("report_cache_total", len(to_fetch), result="bypass" if force_refresh else "miss")
+
+    semaphore = asyncio.Semaphore(settings.REPORT_PREFETCH_CONCURRENCY)
+
+    async def fetch_period(period: int):
+        async with semaphore:
+            params = build_report_params(tin, date_source, period, date_type, year, report_type)
+            return await fetch_report(params, token)
+
+    results = await asyncio.gather(*(fetch_period(period) for period in to_fetch), return_exceptions=True)
+
+    stored = []
+    failed = []
+    fetched = []
+    for period, result in zip(to_fetch, results):
+        if isinstance(result, HTTPException):
+            failed.append({"period": period, "status_code": result.status_code, "detail": result.detail})
+        elif isinstance(result, Exception):
+            failed.append({"period": period, "status_code": 500, "detail": str(result)})
+        else:
+            fetched.append((period, result))
+
+    # Store every fetched report in a single transaction
+    if fetched:
+        try:
+            for period, response_data in fetched:
+                await upsert_report(db, tin, report_type, year, period, response_data.get('data'), current_user.id)
+            await db.commit()
+            await mark_user_write(current_user.id)
+            stored = [period for period, _ in fetched]
+        except Exception as e:
+            await db.rollback()
+            print(f"Error storing prefetched reports: {str(e)}")
+            print(f"Stack trace: {traceback.format_exc()}")
+            failed.extend(
+                {"period": period, "status_code": 500, "detail": f"Failed to store report in database: {str(e)}"}
+                for period, _ in fetched
+            )
+
+    failed.sort(key=lambda f: f["period"])
+    return {
+        "status": 200,
+        "taxpayerNo": tin,
+        "year": year,
+        "reportType": report_type,
+        "stored": stored,
+        "cached": cached,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "timestamp": datetime.now().isoformat()
+    }
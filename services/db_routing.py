@@ -0,0 +1,196 @@
+import asyncio
+import itertools
+import time
+from fastapi import HTTPException, Request
+from sqlalchemy import text
+from config import settings
+from database import (
+    AsyncSessionLocal, AsyncReplicaSessionLocal, SessionLocal, ReplicaSessionLocals, get_async_replica_engines
+)
+from services.redis_client import get_redis
+from services.redis_health import redis_health
+from utils.auth_utils import verify_access_token
+from utils.metrics import metrics
+
+STICKY_KEY_PREFIX = "rw_sticky:"
+
+# Rotates reads over the replicas
+_replica_counter = itertools.count()
+
+def sticky_key(user_id) -> str:
+    """
+    Marker that keeps a user's reads on the primary after their own writes
+    """
+    return f"{STICKY_KEY_PREFIX}{user_id}"
+
+async def mark_user_write(user_id):
+    """
+    Send the user's reads to the primary for REPLICA_STICKY_SECONDS, so
+    they see their own writes before the replicas catch up. Call after
+    the commit.
+    """
+    if not settings.DATABASE_REPLICA_URLS or not user_id:
+        return
+    if not redis_health.allow_request():
+        return
+    try:
+        await get_redis().set(sticky_key(user_id), "1", ex=settings.REPLICA_STICKY_SECONDS)
+    except Exception as e:
+        redis_health.record_failure(e)
+        print(f"Error marking write of user {user_id}: {str(e)}")
+
+async def is_sticky(user_id) -> bool:
+    """
+    Whether the user wrote recently. Without Redis this cannot be known,
+    so reads stay on the primary.
+    """
+    if not redis_health.allow_request():
+        return True
+    try:
+        return bool(await get_redis().exists(sticky_key(user_id)))
+    except Exception as e:
+        redis_health.record_failure(e)
+        return True
+
+def request_user_id(request: Request):
+    """
+    User of a request from the Bearer token, or the login session used by
+    the top level admin pages; None when anonymous
+    """
+    auth_header = request.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        try:
+            payload = verify_access_token(auth_header.split(" ")[1])
+        except HTTPException:
+            # Left for the route's own authentication to reject
+            payload = None
+        if payload and payload.get("user_id"):
+            return payload.get("user_id")
+    if "session" in request.scope:
+        return request.session.get("user_id")
+    return None
+
+class ReplicaLagMonitor:
+    """
+    Polls each replica's replication status in the background. Replicas
+    that are further behind than max_lag, not replicating, or unreachable
+    get no reads until a later check finds them caught up.
+    """
+
+    def __init__(self, interval: float, max_lag: float):
+        self.interval = interval
+        self.max_lag = max_lag
+        # Unchecked replicas are used, the first check runs at startup
+        self.replicas = {
+            f"replica{i}": {"lag_seconds": None, "healthy": True, "last_error": None, "last_check_at": None}
+            for i in range(1, len(settings.DATABASE_REPLICA_URLS) + 1)
+        }
+        self._task = None
+
+    @staticmethod
+    async def replication_lag(engine):
+        """
+        Seconds_Behind_Source of a MySQL replica (None when replication is
+        stopped); 0 for other databases
+        """
+        if engine.dialect.name != "mysql":
+            return 0
+        async with engine.connect() as connection:
+            try:
+                row = (await connection.execute(text("SHOW REPLICA STATUS"))).mappings().first()
+            except Exception:
+                # MySQL before 8.0.22
+                row = (await connection.execute(text("SHOW SLAVE STATUS"))).mappings().first()
+        if row is None:
+            # Not configured as a replica, e.g. a plain copy used locally
+            return 0
+        lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+        return None if lag is None else float(lag)
+
+    async def probe(self):
+        for engine, status in zip(get_async_replica_engines(), self.replicas.values()):
+            status["last_check_at"] = time.time()
+            try:
+                lag = await asyncio.wait_for(self.replication_lag(engine), timeout=self.interval)
+                status["lag_seconds"] = lag
+                status["last_error"] = None if lag is not None else "replication stopped"
+                status["healthy"] = lag is not None and lag <= self.max_lag
+            except Exception as e:
+                status["lag_seconds"] = None
+                status["last_error"] = str(e)
+                status["healthy"] = False
+
+    async def run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Start the background lag check task
+        """
+        if self._task is None and self.replicas:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def healthy_replicas(self) -> list:
+        return [index for index, status in enumerate(self.replicas.values()) if status["healthy"]]
+
+    def status(self) -> dict:
+        return self.replicas
+
+replica_lag_monitor = ReplicaLagMonitor(
+    interval=settings.REPLICA_LAG_INTERVAL,
+    max_lag=settings.REPLICA_MAX_LAG_SECONDS
+)
+
+def pick_replica():
+    """
+    Index of the next healthy replica, or None to read from the primary
+    """
+    healthy = replica_lag_monitor.healthy_replicas()
+    if not healthy:
+        return None
+    return healthy[next(_replica_counter) % len(healthy)]
+
+async def get_read_db(request: Request):
+    """
+    Session for read-only routes: a replica, or the primary when none is
+    healthy or the requesting user wrote within REPLICA_STICKY_SECONDS
+    """
+    replica = None
+    if settings.DATABASE_REPLICA_URLS:
+        user_id = request_user_id(request)
+        if not user_id or not await is_sticky(user_id):
+            replica = pick_replica()
+    metrics.inc("db_read_sessions_total", target="primary" if replica is None else "replica")
+
+    session = AsyncSessionLocal() if replica is None else AsyncReplicaSessionLocal(replica)
+    async with session as db:
+        yield db
+
+def read_session():
+    """
+    Sync session on a healthy replica or the primary, for the sqladmin
+    views. Not sticky, these only show totals and recent rows.
+    """
+    replica = pick_replica() if ReplicaSessionLocals else None
+    metrics.inc("db_read_sessions_total", target="primary" if replica is None else "replica")
+    return SessionLocal() if replica is None else ReplicaSessionLocals[replica]()
+
+def _collect_replicas(registry):
+    for name, status in replica_lag_monitor.replicas.items():
+        if status["lag_seconds"] is not None:
+            registry.set("db_replica_lag_seconds", status["lag_seconds"], replica=name)
+        registry.set("db_replica_healthy", 1 if status["healthy"] else 0, replica=name)
+
+metrics.add_collector(_collect_replicas)
@@ -0,0 +1,171 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import httpx
+
+# Values of these keys are replaced wherever they appear in request or
+# response JSON. The placeholder is derived from a hash of the value, so
+# distinct tokens stay distinct on replay without being stored.
+REDACTED_KEYS = {"token"}
+
+# Token expiry in register responses, moved forward on replay so replayed
+# tokens are not already expired
+EXPIRATION_KEY = "expirationTime"
+EXPIRATION_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+def redact(value):
+    if isinstance(value, dict):
+        return {
+            k: f"<redacted:{hashlib.sha1(str(v).encode()).hexdigest()[:12]}>" if k in REDACTED_KEYS else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+def shift_expiration(value, delta: timedelta):
+    if isinstance(value, dict):
+        shifted = {}
+        for k, v in value.items():
+            if k == EXPIRATION_KEY and isinstance(v, str):
+                try:
+                    moved = datetime.strptime(v[:19], EXPIRATION_FORMAT) + delta
+                    v = moved.strftime(EXPIRATION_FORMAT) + v[19:]
+                except ValueError:
+                    pass
+                shifted[k] = v
+            else:
+                shifted[k] = shift_expiration(v, delta)
+        return shifted
+    if isinstance(value, list):
+        return [shift_expiration(v, delta) for v in value]
+    return value
+
+def _json_body(content: bytes):
+    try:
+        return json.loads(content) if content else None
+    except ValueError:
+        return None
+
+def interaction_key(method: str, path: str, params: list, body) -> str:
+    """
+    What a request is matched on: method, path (not host, so recordings
+    replay against any YAS_BASE_URL), query params and the redacted JSON body.
+    Multipart bodies are not part of the key.
+    """
+    return json.dumps([method, path, sorted(params), redact(body)], sort_keys=True, ensure_ascii=False)
+
+def request_key(request: httpx.Request) -> str:
+    body = None
+    if request.headers.get("content-type", "").startswith("application/json"):
+        body = _json_body(request.content)
+    return interaction_key(request.method, request.url.path, list(request.url.params.multi_items()), body)
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Passes requests to the wrapped transport and appends each request and
+    response to a gzip JSON-lines cassette, with tokens redacted
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, path: str):
+        self.transport = transport
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _append(self, line: str):
+        # Concurrent writers would interleave their gzip members
+        with self._lock:
+            with gzip.open(self.path, "at", encoding="utf-8") as cassette:
+                cassette.write(line)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        content = await response.aread()
+        await response.aclose()
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        key = request_key(request)
+        body = _json_body(content)
+        entry = {
+            "key": key,
+            "url": str(request.url.copy_with(query=None)),
+            "status": response.status_code,
+            "content_type": response.headers.get("content-type"),
+            "elapsed_ms": elapsed_ms,
+            "recorded_at": time.time()
+        }
+        if body is not None:
+            entry["json"] = redact(body)
+        else:
+            entry["text"] = content.decode("utf-8", errors="replace")
+
+        # Compressing and writing would block the event loop
+        await asyncio.to_thread(self._append, json.dumps(entry, ensure_ascii=False) + "\n")
+
+        # content is already decoded, so drop the headers describing the wire format
+        headers = [
+            (name, value) for name, value in response.headers.multi_items()
+            if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")
+        ]
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=headers,
+            content=content,
+            request=request
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Serves responses from a cassette without touching the network. The n-th
+    request with a given key gets the n-th recorded response for that key,
+    cycling when the recording runs out, so replays are deterministic.
+    Unrecorded requests get a 404 naming the missing key.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.interactions = {}
+        self._positions = {}
+        with gzip.open(path, "rt", encoding="utf-8") as cassette:
+            for line in cassette:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.interactions.setdefault(entry["key"], []).append(entry)
+        print(f"Loaded {sum(len(v) for v in self.interactions.values())} recorded interactions from {path}")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.headers.get("content-type", "").startswith("multipart/"):
+            # Drain the upload chunk by chunk so files are read as in live mode
+            async for _ in request.stream:
+                pass
+        key = request_key(request)
+        entries = self.interactions.get(key)
+        if not entries:
+            return httpx.Response(
+                404,
+                json={"status": 404, "msg": f"No recorded interaction for {key}"},
+                request=request
+            )
+
+        position = self._positions.get(key, 0)
+        self._positions[key] = position + 1
+        entry = entries[position % len(entries)]
+        headers = {"content-type": entry["content_type"]} if entry.get("content_type") else {}
+        if "json" in entry:
+            body = shift_expiration(entry["json"], timedelta(seconds=time.time() - entry["recorded_at"]))
+            content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        else:
+            content = entry["text"].encode("utf-8")
+        return httpx.Response(entry["status"], headers=headers, content=content, request=request)
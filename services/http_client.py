@@ -0,0 +1,108 @@
+import httpx
+from config import settings
+from services.http_cassette import RecordingTransport, ReplayTransport
+
+# Shared httpx client for all calls to the third-party tax API. Created once
+# by the app lifespan (see main.py) so connections are kept alive and reused
+# across requests instead of paying TCP/TLS setup on every call.
+_http_client = None
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+# Paths of the third-party endpoints below settings.YAS_BASE_URL
+ENDPOINT_PATHS = {
+    "register": "tenantid/register",
+    "upload": "getexcel/data-impcal",
+    "query": "risk-report/simplified/ow-data"
+}
+
+def endpoint_url(endpoint: str) -> str:
+    """
+    URL of one third-party endpoint ('register', 'upload' or 'query')
+    """
+    return f"{settings.YAS_BASE_URL.rstrip('/')}/{ENDPOINT_PATHS[endpoint]}"
+
+def endpoint_timeout(endpoint: str) -> httpx.Timeout:
+    """
+    Timeout of one third-party endpoint ('register', 'upload' or 'query')
+    """
+    read, connect = settings.YAS_ENDPOINT_TIMEOUTS[endpoint]
+    return httpx.Timeout(read, connect=connect)
+
+def _build_transport(limits: httpx.Limits = None, http2: bool = False):
+    """
+    Transport for settings.YAS_HTTP_MODE: None (httpx default) for 'live',
+    a recorder around the network transport for 'record', or a cassette
+    player that never touches the network for 'replay'
+    """
+    mode = settings.YAS_HTTP_MODE
+    if mode == 'live':
+        return None
+    if mode == 'record':
+        print(f"Recording third-party traffic to {settings.YAS_CASSETTE_PATH}")
+        network = httpx.AsyncHTTPTransport(
+            limits=limits or httpx.Limits(),
+            http2=http2,
+            verify=settings.YAS_VERIFY_SSL
+        )
+        return RecordingTransport(network, settings.YAS_CASSETTE_PATH)
+    if mode == 'replay':
+        print(f"Replaying third-party traffic from {settings.YAS_CASSETTE_PATH}")
+        return ReplayTransport(settings.YAS_CASSETTE_PATH)
+    raise ValueError(f"Unknown YAS_HTTP_MODE: {mode}")
+
+async def init_http_client() -> httpx.AsyncClient:
+    """
+    Create the shared httpx client
+    """
+    global _http_client
+    if _http_client is not None:
+        return _http_client
+
+    http2 = settings.YAS_HTTP2
+    if http2 and not _http2_available():
+        print("HTTP/2 requested but the h2 package is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=settings.YAS_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.YAS_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.YAS_KEEPALIVE_EXPIRY
+    )
+    _http_client = httpx.AsyncClient(
+        transport=_build_transport(limits, http2),
+        limits=limits,
+        timeout=endpoint_timeout('query'),
+        http2=http2,
+        verify=settings.YAS_VERIFY_SSL
+    )
+    return _http_client
+
+async def close_http_client():
+    """
+    Close the shared httpx client and its pooled connections
+    """
+    global _http_client
+    if _http_client is None:
+        return
+    client, _http_client = _http_client, None
+    await client.aclose()
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Shared httpx client. Falls back to lazy creation outside the app
+    lifespan (scripts, workers) so callers never have to check for None.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            transport=_build_transport(),
+            timeout=endpoint_timeout('query'),
+            verify=settings.YAS_VERIFY_SSL
+        )
+    return _http_client
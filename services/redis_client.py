@@ -0,0 +1,98 @@
+import uuid
+import redis
+import redis.asyncio as aioredis
+from config import settings
+
+# Shared asyncio Redis client. The connection pool is created once by the
+# app lifespan (see main.py) and used by every service through get_redis().
+_redis_client = None
+
+async def init_redis():
+    """
+    Create the shared Redis connection pool
+    """
+    global _redis_client
+    if _redis_client is not None:
+        return _redis_client
+
+    pool = aioredis.ConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        password=settings.REDIS_PASSWORD,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        decode_responses=True
+    )
+    _redis_client = aioredis.Redis(connection_pool=pool)
+    try:
+        await _redis_client.ping()
+        print("Successfully connected to Redis")
+    except redis.ConnectionError as e:
+        print(f"Failed to connect to Redis: {e}")
+        print("Please ensure Redis server is running")
+    except Exception as e:
+        print(f"Unexpected error connecting to Redis: {e}")
+    return _redis_client
+
+async def close_redis():
+    """
+    Close the shared Redis client and disconnect its pool
+    """
+    global _redis_client
+    if _redis_client is None:
+        return
+    client, _redis_client = _redis_client, None
+    await client.close()
+    await client.connection_pool.disconnect()
+
+def get_redis():
+    """
+    Shared Redis client, or None before init_redis() has run
+    """
+    return _redis_client
+
+def _lock_client():
+    redis_client = get_redis()
+    if redis_client is None:
+        raise RuntimeError("Redis is not initialised, init_redis() has not run")
+    return redis_client
+
+# Delete the lock only if it still holds our token
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+async def acquire_lock(key: str, ttl_seconds: float):
+    """
+    Try to take a Redis lock. Returns the lock token, or None if it is held.
+    """
+    token = uuid.uuid4().hex
+    if await _lock_client().set(key, token, nx=True, px=int(ttl_seconds * 1000)):
+        return token
+    return None
+
+async def release_lock(key: str, token: str):
+    """
+    Release a lock taken with acquire_lock()
+    """
+    await _lock_client().eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
+
+# Push the lock's expiry out only if it still holds our token
+_EXTEND_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+async def extend_lock(key: str, token: str, ttl_seconds: float) -> bool:
+    """
+    Reset the TTL of a lock taken with acquire_lock(). Returns False if the
+    lock expired or was taken over.
+    """
+    return bool(await _lock_client().eval(_EXTEND_LOCK_SCRIPT, 1, key, token, int(ttl_seconds * 1000)))
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from config import settings
+from services.redis_client import get_redis
+from utils.metrics import metrics
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class RedisHealthMonitor:
+    """
+    Tracks Redis health from a background PING loop so request paths can
+    fail fast from the cached state instead of probing Redis themselves.
+
+    closed    -> Redis is healthy, requests go through
+    open      -> failure_threshold consecutive failures, requests are rejected
+    half_open -> reset_timeout elapsed since opening, requests are let
+                 through again until the next probe decides
+    """
+
+    def __init__(self, interval: float, failure_threshold: int, reset_timeout: float):
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_check_at = None
+        self.last_latency_ms = None
+        self.opened_at = None
+        self._task = None
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            print(f"Redis circuit state: {self.state} -> {state}")
+            metrics.inc("redis_circuit_transitions_total", to_state=state)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+
+    def allow_request(self) -> bool:
+        """
+        Whether callers should talk to Redis right now
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.last_error = None
+        self._set_state(CLOSED)
+
+    def record_failure(self, error: Exception):
+        """
+        Record a failed Redis call, from the probe or from a request path
+        """
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+        metrics.inc("redis_failures_total")
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._set_state(OPEN)
+
+    async def probe(self):
+        """
+        PING Redis once and update the circuit state
+        """
+        redis_client = get_redis()
+        started = time.monotonic()
+        self.last_check_at = time.time()
+        try:
+            if not redis_client:
+                raise ConnectionError("Redis client not initialized")
+            await asyncio.wait_for(redis_client.ping(), timeout=settings.REDIS_HEALTH_TIMEOUT)
+            self.last_latency_ms = round((time.monotonic() - started) * 1000, 2)
+            self.record_success()
+        except Exception as e:
+            self.last_latency_ms = None
+            self.record_failure(e)
+
+    async def run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Start the background health check task
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_check_at": self.last_check_at,
+            "last_latency_ms": self.last_latency_ms
+        }
+
+redis_health = RedisHealthMonitor(
+    interval=settings.REDIS_HEALTH_INTERVAL,
+    failure_threshold=settings.REDIS_HEALTH_FAILURE_THRESHOLD,
+    reset_timeout=settings.REDIS_HEALTH_RESET_TIMEOUT
+)
+
+def _collect_redis_health(registry):
+    registry.set("redis_circuit_state", STATE_VALUES[redis_health.state])
+    if redis_health.last_latency_ms is not None:
+        registry.set("redis_ping_latency_ms", redis_health.last_latency_ms)
+
+metrics.add_collector(_collect_redis_health)
@@ -0,0 +1,99 @@
+from services.redis_client import get_redis
+
+# Upper bounds (seconds) of the TTL histogram buckets
+TTL_BUCKETS = [
+    ("<1m", 60),
+    ("<1h", 3600),
+    ("<1d", 86400),
+    ("<7d", 7 * 86400),
+    (">=7d", None)
+]
+
+# Most keys per family the admin endpoint may sample with MEMORY USAGE
+MAX_SAMPLE_PER_FAMILY = 1000
+
+def key_family(key: str) -> str:
+    """
+    Key family of a Redis key, e.g. yas_token:42 -> yas_token
+    """
+    return key.split(':', 1)[0]
+
+def _ttl_bucket(ttl: int) -> str:
+    if ttl == -1:
+        return "no_expiry"
+    for label, upper in TTL_BUCKETS:
+        if upper is None or ttl < upper:
+            return label
+    return TTL_BUCKETS[-1][0]
+
+def _new_family_stats() -> dict:
+    return {
+        "count": 0,
+        "sampled": 0,
+        "sampled_bytes": 0,
+        "ttl_histogram": {label: 0 for label in ["no_expiry"] + [b[0] for b in TTL_BUCKETS]}
+    }
+
+async def collect_key_family_report(sample_per_family: int = 100, scan_count: int = 1000) -> dict:
+    """
+    Walk the keyspace with a single SCAN and report, per key family, the key
+    count, estimated total bytes (MEMORY USAGE on up to sample_per_family keys,
+    extrapolated) and a TTL histogram. TTL and MEMORY USAGE calls are
+    pipelined per SCAN batch.
+    """
+    redis_client = get_redis()
+    families = {}
+    cursor = 0
+    while True:
+        cursor, keys = await redis_client.scan(cursor=cursor, count=scan_count)
+        if keys:
+            sampled_keys = []
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    stats = families.setdefault(key_family(key), _new_family_stats())
+                    stats["count"] += 1
+                    pipe.ttl(key)
+                    if stats["sampled"] < sample_per_family:
+                        stats["sampled"] += 1
+                        sampled_keys.append(key)
+                for key in sampled_keys:
+                    pipe.memory_usage(key)
+                results = await pipe.execute()
+
+            for key, ttl in zip(keys, results[:len(keys)]):
+                if ttl == -2:
+                    continue
+                families[key_family(key)]["ttl_histogram"][_ttl_bucket(ttl)] += 1
+            for key, size in zip(sampled_keys, results[len(keys):]):
+                families[key_family(key)]["sampled_bytes"] += size or 0
+        if cursor == 0:
+            break
+
+    report = {}
+    for family, stats in sorted(families.items()):
+        average = stats["sampled_bytes"] / stats["sampled"] if stats["sampled"] else 0
+        report[family] = {
+            "count": stats["count"],
+            "sampled": stats["sampled"],
+            "avg_bytes": round(average, 1),
+            "estimated_total_bytes": int(average * stats["count"]),
+            "ttl_histogram": stats["ttl_histogram"]
+        }
+    return {
+        "families": report,
+        "total_keys": sum(f["count"] for f in report.values()),
+        "estimated_total_bytes": sum(f["estimated_total_bytes"] for f in report.values())
+    }
+
+async def expire_keys_without_ttl(family: str, ttl: int, scan_count: int = 1000) -> int:
+    """
+    Give every key of a family that has no expiry the supplied TTL.
+    Returns the number of keys updated.
+    """
+    redis_client = get_redis()
+    updated = 0
+    async for key in redis_client.scan_iter(f"{family}:*", count=scan_count):
+        if await redis_client.ttl(key) == -1:
+            await redis_client.expire(key, ttl)
+            updated += 1
+    return updated
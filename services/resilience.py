@@ -0,0 +1,167 @@
+import asyncio
+import random
+import time
+import httpx
+from fastapi import HTTPException
+from config import settings
+from services.redis_health import CLOSED, OPEN, HALF_OPEN, STATE_VALUES
+from utils.metrics import metrics
+
+# Errors raised before the request reached the third party; retrying them
+# cannot duplicate work, even for non-idempotent endpoints
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker for the third-party tax API.
+
+    closed    -> calls go through
+    open      -> failure_threshold consecutive failed calls, calls are
+                 rejected without touching the network
+    half_open -> reset_timeout elapsed since opening, a single trial call is
+                 let through and decides between closed and open
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int, reset_timeout: float):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            print(f"Upstream circuit {self.endpoint}: {self.state} -> {state}")
+            metrics.inc("upstream_circuit_transitions_total", endpoint=self.endpoint, to_state=state)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+
+    def allow_request(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        return True
+
+    def release_trial(self):
+        """
+        Give up the half-open trial slot without an outcome, e.g. when the
+        call was cancelled or failed before reaching the third party
+        """
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self._trial_in_flight = False
+        self.consecutive_failures = 0
+        self.last_error = None
+        self._set_state(CLOSED)
+
+    def record_failure(self, error: str):
+        self._trial_in_flight = False
+        self.consecutive_failures += 1
+        self.last_error = error
+        metrics.inc("upstream_failures_total", endpoint=self.endpoint)
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._set_state(OPEN)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error
+        }
+
+breakers = {
+    endpoint: CircuitBreaker(
+        endpoint,
+        failure_threshold=settings.YAS_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.YAS_BREAKER_RESET_TIMEOUT
+    )
+    for endpoint in settings.YAS_ENDPOINT_TIMEOUTS
+}
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff before retry number `attempt`
+    """
+    cap = min(settings.YAS_RETRY_MAX_DELAY, settings.YAS_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return random.uniform(0, cap)
+
+async def call_upstream(endpoint: str, send, idempotent: bool) -> httpx.Response:
+    """
+    Run send() - one attempt at a third-party call returning an
+    httpx.Response - behind the endpoint's circuit breaker, retrying
+    transient failures with jittered backoff.
+
+    Connection failures are always retried since nothing reached the
+    third party. Timeouts after sending, 5xx and empty responses are only
+    retried for idempotent endpoints. When retries run out, the last
+    response is returned or the last error re-raised, so callers keep their
+    own error handling. An open circuit raises a 503 straight away.
+
+    The breaker sees one outcome per call, not per attempt, so a call that
+    exhausts its retries counts once toward the failure threshold.
+    """
+    breaker = breakers[endpoint]
+    if not breaker.allow_request():
+        metrics.inc("upstream_rejected_total", endpoint=endpoint)
+        raise HTTPException(
+            status_code=503,
+            detail=f"Third-party {endpoint} service is unavailable, please retry later"
+        )
+
+    recorded = False
+    attempt = 0
+    try:
+        while True:
+            attempt += 1
+            response = None
+            try:
+                response = await send()
+            except NOT_SENT_ERRORS as e:
+                retryable, reason, error, failure = True, "connect", e, repr(e)
+            except httpx.RequestError as e:
+                reason = "timeout" if isinstance(e, httpx.TimeoutException) else "transport"
+                retryable, error, failure = idempotent, e, repr(e)
+            else:
+                if response.status_code >= 500:
+                    retryable, reason, failure = idempotent, "5xx", f"HTTP {response.status_code}"
+                elif not response.content:
+                    retryable, reason, failure = idempotent, "empty", "empty response"
+                else:
+                    breaker.record_success()
+                    recorded = True
+                    return response
+                error = None
+
+            # Stop retrying as well once other calls opened the circuit
+            if not retryable or attempt >= settings.YAS_RETRY_MAX_ATTEMPTS or breaker.state == OPEN:
+                breaker.record_failure(failure)
+                recorded = True
+                if error is not None:
+                    raise error
+                return response
+
+            delay = backoff_delay(attempt)
+            metrics.inc("upstream_retries_total", endpoint=endpoint, reason=reason)
+            print(f"Retrying {endpoint} call after {reason} (attempt {attempt}) in {delay:.2f}s")
+            await asyncio.sleep(delay)
+    finally:
+        if not recorded:
+            # Cancelled, or send() failed locally (e.g. rewinding an upload
+            # file); let the next caller run the half-open trial
+            breaker.release_trial()
+
+def _collect_breakers(registry):
+    for endpoint, breaker in breakers.items():
+        registry.set("upstream_circuit_state", STATE_VALUES[breaker.state], endpoint=endpoint)
+
+metrics.add_collector(_collect_breakers)
@@ -1,51 +1,75 @@
 from typing import List, Dict, Any
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+from sqlalchemy import func, select
 from models import User, Channel, CompanyReport, CompanyInfo, ReportTransaction
+from services.channel import latest_company_info_id
+from utils.pagination import keyset_page, page_envelope
 
-async def get_dashboard_data(db: Session, user_id: int) -> Dict[str, Any]:
+async def get_company_reports(db: AsyncSession, user_id: int, cursor: str = None, page_size: int = None) -> Dict[str, Any]:
     """
-    Get dashboard data for a second-level user including their company reports,
-    channel information, and statistics.
+    Get one page of a second-level user's company reports, newest first
+    """
+    company_reports = (await db.scalars(keyset_page(
+        select(CompanyReport)
+        .join(CompanyInfo, CompanyInfo.id == latest_company_info_id())
+        .options(contains_eager(CompanyReport.company_info))
+        .where(CompanyReport.processed_by_user_id == user_id),
+        CompanyReport.created_at, CompanyReport.id, cursor, page_size
+    ))).all()
+
+    return page_envelope(company_reports, page_size, serialize=lambda report: {
+        "id": report.id,
+        "created_at": report.created_at,
+        "report_type": report.report_type,
+        "year": report.year,
+        "month": report.month,
+        "quarter": report.quarter,
+        "company_info": {
+            "company_name": report.company_info.company_name,
+            "tax_number": report.company_info.tax_number,
+            "industry": report.company_info.industry
+        }
+    })
+
+async def get_dashboard_data(db: AsyncSession, user_id: int, page_size: int = None) -> Dict[str, Any]:
+    """
+    Get dashboard data for a second-level user including the first page of
+    their company reports, channel information, and statistics.
     """
     # Get user with their channel
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise ValueError("User not found")
 
     # Get channel information
-    channel = db.query(Channel).filter(Channel.id == user.channel_id).first()
+    channel = await db.scalar(select(Channel).where(Channel.id == user.channel_id))
     if not channel:
         raise ValueError("Channel not found")
 
-    # Get user's company reports with company info
-    company_reports = (
-        db.query(CompanyReport)
-        .join(CompanyInfo)
-        .filter(CompanyReport.processed_by_user_id == user_id)
-        .order_by(CompanyReport.created_at.desc())
-        .all()
-    )
+    # Get the first page of the user's company reports with company info
+    company_reports = await get_company_reports(db, user_id, page_size=page_size)
 
     # Get user's statistics
     stats = {
-        "total_uploads": (
-            db.query(func.count(ReportTransaction.id))
-            .filter(
+        "total_uploads": await db.scalar(
+            select(func.count(ReportTransaction.id))
+            .where(
                 ReportTransaction.user_id == user_id,
                 ReportTransaction.transaction_type == "UPLOAD"
             )
-            .scalar()
         ),
-        "total_downloads": (
-            db.query(func.count(ReportTransaction.id))
-            .filter(
+        "total_downloads": await db.scalar(
+            select(func.count(ReportTransaction.id))
+            .where(
                 ReportTransaction.user_id == user_id,
                 ReportTransaction.transaction_type == "DOWNLOAD"
             )
-            .scalar()
         ),
-        "total_reports": len(company_reports)
+        "total_reports": await db.scalar(
+            select(func.count(CompanyReport.id))
+            .where(CompanyReport.processed_by_user_id == user_id)
+        )
     }
 
     return {
@@ -67,17 +91,5 @@ async def get_dashboard_data(db: Session, user_id: int) -> Dict[str, Any]:
             "registration_time": channel.registration_time
         },
         "stats": stats,
-        "company_reports": [{
-            "id": report.id,
-            "created_at": report.created_at,
-            "report_type": report.report_type,
-            "year": report.year,
-            "month": report.month,
-            "quarter": report.quarter,
-            "company_info": {
-                "company_name": report.company_info.company_name,
-                "tax_number": report.company_info.tax_number,
-                "industry": report.company_info.industry
-            }
-        } for report in company_reports]
+        "company_reports": company_reports
     }
@@ -0,0 +1,264 @@
+import asyncio
+import os
+import re
+import signal
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from config import settings
+from utils.metrics import metrics
+from utils.ttl_cache import TTLCache
+
+# Spreadsheet readers are optional; files whose reader is missing are not
+# validated locally and are left to the third party
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+# Rows scanned per sheet for headers and the tax period
+SCAN_ROWS = 30
+
+# dateType of a tax period spanning this many months
+PERIOD_DATE_TYPES = {12: 0, 3: 1, 1: 2}
+DATE_TYPE_NAMES = {0: "annual", 1: "quarterly", 2: "monthly"}
+
+DATE_PATTERN = re.compile(r"(20\d{2})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})")
+PERIOD_LABELS = ("所属期", "所属时期", "报告期")
+
+# Inspection results by file content hash
+inspection_cache = TTLCache(max_entries=settings.SPREADSHEET_CACHE_MAX_ENTRIES)
+
+_executor = None
+
+def reader_available(filename: str) -> bool:
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        return openpyxl is not None
+    if extension == ".xls":
+        return xlrd is not None
+    return False
+
+def _dates_in(value):
+    if isinstance(value, datetime):
+        return [value]
+    if isinstance(value, str):
+        dates = []
+        for year, month, day in DATE_PATTERN.findall(value):
+            try:
+                dates.append(datetime(int(year), int(month), int(day)))
+            except ValueError:
+                pass
+        return dates
+    return []
+
+def _read_rows(path: str):
+    """
+    First SCAN_ROWS rows of every sheet as {sheet name: [row values]}
+    """
+    if path.lower().endswith(".xls"):
+        book = xlrd.open_workbook(path, on_demand=True)
+        try:
+            sheets = {}
+            for sheet in book.sheets():
+                rows = []
+                for r in range(min(sheet.nrows, SCAN_ROWS)):
+                    row = []
+                    for c in range(sheet.ncols):
+                        value = sheet.cell_value(r, c)
+                        if sheet.cell_type(r, c) == xlrd.XL_CELL_DATE:
+                            value = xlrd.xldate_as_datetime(value, book.datemode)
+                        row.append(value)
+                    rows.append(row)
+                sheets[sheet.name] = rows
+            return sheets
+        finally:
+            book.release_resources()
+
+    book = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        return {
+            sheet.title: [list(row) for row in sheet.iter_rows(max_row=SCAN_ROWS, values_only=True)]
+            for sheet in book.worksheets
+        }
+    finally:
+        book.close()
+
+def _check_uncompressed_size(path: str):
+    """
+    Refuse .xlsx/.xlsm archives that would inflate beyond
+    SPREADSHEET_MAX_UNCOMPRESSED_SIZE before any part is decompressed
+    """
+    if not zipfile.is_zipfile(path):
+        return
+    with zipfile.ZipFile(path) as archive:
+        size = sum(member.file_size for member in archive.infolist())
+    if size > settings.SPREADSHEET_MAX_UNCOMPRESSED_SIZE:
+        raise ValueError(f"workbook inflates to {size} bytes")
+
+def _time_limit_exceeded(signum, frame):
+    raise TimeoutError("inspection took too long")
+
+def inspect_spreadsheet(path: str, time_limit: float = None) -> dict:
+    """
+    Sheet names, header rows and the tax period of a workbook.
+    Runs in a worker process, and gives up after time_limit seconds so a
+    pathological workbook cannot keep the worker busy after the caller
+    stopped waiting.
+    """
+    # Worker processes run tasks in their main thread, where SIGALRM is
+    # delivered; not available on Windows
+    use_alarm = bool(time_limit) and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _time_limit_exceeded)
+        signal.setitimer(signal.ITIMER_REAL, time_limit)
+    try:
+        _check_uncompressed_size(path)
+        sheets = _read_rows(path)
+    except TimeoutError:
+        # Not a verdict on the file; the upload goes ahead unvalidated
+        raise
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {str(e)}"}
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    headers = {}
+    period_dates = []
+    for name, rows in sheets.items():
+        non_empty = [row for row in rows if any(v not in (None, "") for v in row)]
+        headers[name] = [str(v) for v in non_empty[0] if v not in (None, "")] if non_empty else []
+        for row in rows:
+            labelled = any(isinstance(v, str) and any(label in v for label in PERIOD_LABELS) for v in row)
+            if labelled:
+                for value in row:
+                    period_dates.extend(_dates_in(value))
+
+    info = {"sheets": list(sheets), "headers": headers, "period_start": None, "period_end": None, "period_months": None}
+    if period_dates:
+        start, end = min(period_dates), max(period_dates)
+        info["period_start"] = start.strftime("%Y-%m-%d")
+        info["period_end"] = end.strftime("%Y-%m-%d")
+        info["period_months"] = (end.year - start.year) * 12 + end.month - start.month + 1
+    return info
+
+def validation_errors(info: dict, year: int, date_type: int) -> list:
+    """
+    Reasons an inspected workbook does not fit the upload parameters
+    """
+    if info.get("error"):
+        return [f"cannot be read as a spreadsheet ({info['error']})"]
+    if not any(info["headers"].values()):
+        return ["contains no data"]
+
+    errors = []
+    if info["period_start"]:
+        period_year = int(info["period_start"][:4])
+        if period_year != year:
+            errors.append(f"tax period {info['period_start']} - {info['period_end']} is not in {year}")
+        detected_type = PERIOD_DATE_TYPES.get(info["period_months"])
+        if detected_type is not None and detected_type != date_type:
+            errors.append(
+                f"tax period {info['period_start']} - {info['period_end']} is {DATE_TYPE_NAMES[detected_type]}, "
+                f"not {DATE_TYPE_NAMES.get(date_type, date_type)}"
+            )
+    return errors
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.SPREADSHEET_VALIDATION_WORKERS)
+    return _executor
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    """
+    Drop a pool whose worker died (BrokenProcessPool); the next upload
+    starts a new one
+    """
+    global _executor
+    if _executor is executor:
+        _executor = None
+        print("Spreadsheet validation pool broke, starting a new one")
+        metrics.inc("spreadsheet_validation_pool_restarts_total")
+    executor.shutdown(wait=False)
+
+def _submit(loop, path: str):
+    executor = _get_executor()
+    try:
+        future = loop.run_in_executor(executor, inspect_spreadsheet, path, settings.SPREADSHEET_VALIDATION_TIMEOUT)
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        executor = _get_executor()
+        future = loop.run_in_executor(executor, inspect_spreadsheet, path, settings.SPREADSHEET_VALIDATION_TIMEOUT)
+    return executor, future
+
+def shutdown_validation_pool():
+    """
+    Stop the worker processes
+    """
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        executor.shutdown(wait=False)
+
+async def validate_upload_files(files: list, file_hashes: list, year: int, date_type: int) -> dict:
+    """
+    Inspect each (filename, file object, content type) upload in the process
+    pool, or from the cache by content hash, and return
+    {(index, filename): [errors]} for the files that do not fit year and
+    date_type. Keyed by position, since a batch may repeat a filename.
+    File objects must be backed by files on disk.
+    """
+    if not settings.SPREADSHEET_VALIDATION_ENABLED:
+        return {}
+
+    loop = asyncio.get_running_loop()
+    pending = {}
+    inspections = {}
+    for index, ((filename, fileobj, _), file_hash) in enumerate(zip(files, file_hashes)):
+        upload = (index, filename)
+        if not reader_available(filename) or not os.path.exists(getattr(fileobj, "name", "") or ""):
+            metrics.inc("spreadsheet_validation_total", result="skipped")
+            continue
+        cached = inspection_cache.get(file_hash)
+        if cached is not None:
+            inspections[upload] = cached
+        else:
+            pending[upload] = (file_hash, *_submit(loop, fileobj.name))
+
+    for upload, (file_hash, executor, future) in pending.items():
+        try:
+            # A little slack over the worker's own time limit
+            info = await asyncio.wait_for(future, timeout=settings.SPREADSHEET_VALIDATION_TIMEOUT + 1)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                _discard_executor(executor)
+            # Never block an upload on a local validation problem
+            print(f"Skipping validation of file {upload[0] + 1} ({upload[1]}): {type(e).__name__}: {str(e)}")
+            metrics.inc("spreadsheet_validation_total", result="error")
+            continue
+        inspection_cache.set(file_hash, info, settings.SPREADSHEET_CACHE_TTL_SECONDS)
+        inspections[upload] = info
+
+    rejected = {}
+    for upload, info in sorted(inspections.items()):
+        errors = validation_errors(info, year, date_type)
+        metrics.inc("spreadsheet_validation_total", result="rejected" if errors else "ok")
+        if errors:
+            rejected[upload] = errors
+    return rejected
+
+def _collect_inspection_cache(registry):
+    stats = inspection_cache.stats()
+    registry.set("spreadsheet_inspection_cache_entries", stats["size"])
+    registry.set("spreadsheet_inspection_cache_hits", stats["hits"])
+    registry.set("spreadsheet_inspection_cache_misses", stats["misses"])
+
+metrics.add_collector(_collect_inspection_cache)
@@ -0,0 +1,172 @@
+import asyncio
+import time
+import traceback
+from config import settings
+from services.redis_client import get_redis
+from services.auth import (
+    TOKEN_EXPIRY_KEY, token_key, from_hash_fields, register_tenant, clear_user_token
+)
+from utils.metrics import metrics
+
+# Token record fields needed to replay the tenant registration
+REGISTRATION_FIELDS = [
+    'userId', 'taxpayerNo', 'companyName', 'indexStandardType',
+    'industry', 'registrationType', 'taxpayerNature'
+]
+
+def build_registration_request(record: dict) -> dict:
+    """
+    Rebuild the tenantid/register payload from a stored token record,
+    matching what the /api/v1/register route sends
+    """
+    return {
+        "companyName": record['companyName'],
+        "indexStandardType": int(record['indexStandardType']),
+        "industry": int(record['industry']),
+        "registrationType": int(record['registrationType']),
+        "taxpayerNature": int(record['taxpayerNature']),
+        "taxpayerNo": record['taxpayerNo'],
+        "userId": int(record['userId']) if record.get('userId') else None
+    }
+
+class TokenRefreshScheduler:
+    """
+    Re-registers tenants whose third-party token expires within `window`
+    seconds, so users never hit a lapsed token on upload or download.
+    A per-tenant Redis lock keeps several workers from refreshing the same
+    tenant twice. After a failure the lock is kept for an exponential
+    backoff, and a tenant that keeps failing is dropped from the schedule.
+    """
+
+    def __init__(self, interval: float, window: float, concurrency: int,
+                 max_failures: int, max_backoff: float):
+        self.interval = interval
+        self.window = window
+        self.concurrency = concurrency
+        self.max_failures = max_failures
+        self.max_backoff = max_backoff
+        self._task = None
+
+    def backoff(self, failures: int) -> int:
+        """
+        Seconds before the next attempt after `failures` consecutive failures
+        """
+        return int(max(1, min(self.interval * 2 ** (failures - 1), self.max_backoff)))
+
+    async def record_failure(self, system_user_id: str, lock_key: str) -> bool:
+        """
+        Count a failed refresh shared across workers. Returns True while the
+        tenant stays scheduled, with the lock held for the backoff.
+        """
+        redis_client = get_redis()
+        failures_key = f"token_refresh_failures:{system_user_id}"
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incr(failures_key)
+            # Outlives the longest backoff so the count is not lost in between
+            pipe.expire(failures_key, int(self.max_backoff + self.window))
+            failures, _ = await pipe.execute()
+
+        if failures >= self.max_failures:
+            await redis_client.zrem(TOKEN_EXPIRY_KEY, system_user_id)
+            await redis_client.delete(failures_key)
+            metrics.inc("token_refresh_total", result="abandoned")
+            print(f"Giving up token refresh for system_user_id {system_user_id} after {failures} failures")
+            return False
+
+        delay = self.backoff(failures)
+        await redis_client.set(lock_key, "1", ex=delay)
+        print(f"Retrying token refresh for system_user_id {system_user_id} in {delay}s (failure {failures})")
+        return True
+
+    async def refresh_tenant(self, system_user_id: str, semaphore: asyncio.Semaphore):
+        redis_client = get_redis()
+        lock_key = f"token_refresh_lock:{system_user_id}"
+        async with semaphore:
+            if not await redis_client.set(lock_key, "1", nx=True, ex=settings.TOKEN_REFRESH_LOCK_SECONDS):
+                return
+            keep_lock = False
+            try:
+                values = await redis_client.hmget(token_key(system_user_id), REGISTRATION_FIELDS)
+                record = from_hash_fields(dict(zip(REGISTRATION_FIELDS, values)))
+                if not record.get('taxpayerNo'):
+                    # Record lapsed or was cleared since it was scheduled
+                    await redis_client.zrem(TOKEN_EXPIRY_KEY, system_user_id)
+                    metrics.inc("token_refresh_expired_total")
+                    return
+
+                # register_tenant rewrites the record, index and schedule
+                # entry atomically in one MULTI pipeline
+                result = await register_tenant(build_registration_request(record))
+                new_system_user_id = str(result.get('systemUserId'))
+                if new_system_user_id != str(system_user_id):
+                    await clear_user_token(system_user_id)
+                await redis_client.delete(f"token_refresh_failures:{system_user_id}")
+                metrics.inc("token_refresh_total", result="refreshed")
+                print(f"Refreshed token for system_user_id {system_user_id}")
+            except Exception as e:
+                metrics.inc("token_refresh_total", result="failed")
+                print(f"Token refresh failed for system_user_id {system_user_id}: {str(e)}")
+                try:
+                    keep_lock = await self.record_failure(system_user_id, lock_key)
+                except Exception as e:
+                    # The lock expires after TOKEN_REFRESH_LOCK_SECONDS instead
+                    keep_lock = True
+                    print(f"Error recording token refresh failure for system_user_id {system_user_id}: {str(e)}")
+            finally:
+                # After a failure the lock holds off retries for the backoff
+                if not keep_lock:
+                    await redis_client.delete(lock_key)
+
+    async def run_once(self):
+        """
+        Refresh every tenant due within the window and drop lapsed entries
+        """
+        redis_client = get_redis()
+        now = time.time()
+
+        expired = await redis_client.zrangebyscore(TOKEN_EXPIRY_KEY, '-inf', now)
+        if expired:
+            await redis_client.zrem(TOKEN_EXPIRY_KEY, *expired)
+            metrics.inc("token_refresh_expired_total", len(expired))
+
+        due = await redis_client.zrangebyscore(TOKEN_EXPIRY_KEY, now, now + self.window)
+        metrics.set("token_refresh_due", len(due))
+        if not due:
+            return
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self.refresh_tenant(system_user_id, semaphore) for system_user_id in due))
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Token refresh run failed: {str(e)}")
+                print(f"Stack trace: {traceback.format_exc()}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Start the background refresh task
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+token_refresh_scheduler = TokenRefreshScheduler(
+    interval=settings.TOKEN_REFRESH_INTERVAL,
+    window=settings.TOKEN_REFRESH_WINDOW,
+    concurrency=settings.TOKEN_REFRESH_CONCURRENCY,
+    max_failures=settings.TOKEN_REFRESH_MAX_FAILURES,
+    max_backoff=settings.TOKEN_REFRESH_MAX_BACKOFF
+)
@@ -1,16 +1,24 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, selectinload, undefer
+from sqlalchemy import and_, func, select
 from typing import List, Dict, Optional
 from models import User, Channel, CompanyReport, CompanyInfo
 from fastapi import HTTPException
+from services.channel import latest_company_info_id
+from utils.pagination import keyset_page, page_envelope
+
+# Channels per page of the top level admin dashboard
+CHANNELS_PAGE_SIZE = 20
+# Users per page of the channel detail page
+CHANNEL_USERS_PAGE_SIZE = 50
 
 class TopLevelAdminService:
     @staticmethod
-    def get_dashboard_stats(db: Session) -> Dict:
+    async def get_dashboard_stats(db: AsyncSession) -> Dict:
         """Get overall statistics for the dashboard"""
-        total_channels = db.query(Channel).count()
-        total_users = db.query(User).count()
-        total_reports = db.query(CompanyReport).count()
+        total_channels = await db.scalar(select(func.count(Channel.id)))
+        total_users = await db.scalar(select(func.count(User.id)))
+        total_reports = await db.scalar(select(func.count(CompanyReport.id)))
         
         return {
             "total_channels": total_channels,
@@ -19,43 +27,87 @@ class TopLevelAdminService:
         }
 
     @staticmethod
-    def get_all_channels(db: Session) -> List[Dict]:
-        """Get all channels with their users and reports"""
-        channels = db.query(Channel).all()
-        
-        result = []
-        for channel in channels:
-            channel_data = {
-                "id": channel.id,
-                "channel_number": channel.channel_number,
-                "channel_name": channel.channel_name,
-                "channel_location": channel.channel_location,
-                "users": [],
-                "total_reports": 0
-            }
-            
-            # Get all users for this channel
-            for user in channel.users:
-                user_data = {
-                    "id": user.id,
-                    "username": user.username,
-                    "role": user.role,
-                    "reports_count": len(user.company_reports)
+    async def get_all_channels(db: AsyncSession, page: int = 1, page_size: int = CHANNELS_PAGE_SIZE) -> List[Dict]:
+        """
+        Get one page of channels with their users and per-user report counts.
+        A single grouped query; reports are counted, never loaded.
+        """
+        page_channels = (
+            select(Channel.id)
+            .order_by(Channel.id)
+            .limit(page_size)
+            .offset((page - 1) * page_size)
+            .subquery()
+        )
+        rows = (await db.execute(
+            select(
+                Channel.id,
+                Channel.channel_number,
+                Channel.channel_name,
+                Channel.channel_location,
+                User.id.label("user_id"),
+                User.username,
+                User.role,
+                func.count(CompanyReport.id).label("reports_count")
+            )
+            .join(page_channels, page_channels.c.id == Channel.id)
+            .outerjoin(User, User.channel_id == Channel.id)
+            .outerjoin(CompanyReport, CompanyReport.processed_by_user_id == User.id)
+            .group_by(Channel.id, User.id)
+            .order_by(Channel.id, User.id)
+        )).all()
+
+        channels = {}
+        for row in rows:
+            channel_data = channels.get(row.id)
+            if channel_data is None:
+                channel_data = channels[row.id] = {
+                    "id": row.id,
+                    "channel_number": row.channel_number,
+                    "channel_name": row.channel_name,
+                    "channel_location": row.channel_location,
+                    "users": [],
+                    "total_reports": 0
                 }
-                channel_data["users"].append(user_data)
-                channel_data["total_reports"] += user_data["reports_count"]
-            
-            result.append(channel_data)
-        
-        return result
+            # Channels without users come back as one row without a user
+            if row.user_id is not None:
+                channel_data["users"].append({
+                    "id": row.user_id,
+                    "username": row.username,
+                    "role": row.role,
+                    "reports_count": row.reports_count
+                })
+                channel_data["total_reports"] += row.reports_count
+
+        return list(channels.values())
 
     @staticmethod
-    def get_channel_details(db: Session, channel_id: int) -> Dict:
-        """Get detailed information about a specific channel"""
-        channel = db.query(Channel).filter(Channel.id == channel_id).first()
+    async def get_channel_details(db: AsyncSession, channel_id: int, page: int = 1, page_size: int = CHANNEL_USERS_PAGE_SIZE) -> Dict:
+        """
+        Get a channel with one page of its users and their report counts.
+        Reports themselves are fetched per user with get_channel_user_reports.
+        """
+        channel = await db.get(Channel, channel_id)
         if not channel:
             raise HTTPException(status_code=404, detail="Channel not found")
-        
+
+        total_users = await db.scalar(select(func.count(User.id)).where(User.channel_id == channel_id))
+        page_users = (
+            select(User.id)
+            .where(User.channel_id == channel_id)
+            .order_by(User.id)
+            .limit(page_size)
+            .offset((page - 1) * page_size)
+            .subquery()
+        )
+        rows = (await db.execute(
+            select(User.id, User.username, User.role, func.count(CompanyReport.id).label("reports_count"))
+            .join(page_users, page_users.c.id == User.id)
+            .outerjoin(CompanyReport, CompanyReport.processed_by_user_id == User.id)
+            .group_by(User.id)
+            .order_by(User.id)
+        )).all()
+
         return {
             "id": channel.id,
             "channel_number": channel.channel_number,
@@ -71,45 +123,88 @@ class TopLevelAdminService:
             "douyin_account": channel.douyin_account,
             "balance": channel.balance,
             "users": [{
-                "id": user.id,
-                "username": user.username,
-                "role": user.role,
-                "reports": [{
-                    "id": report.id,
-                    "company_name": report.company_info.company_name,
-                    "report_type": report.report_type,
-                    "year": report.year,
-                    "month": report.month,
-                    "quarter": report.quarter,
-                    "created_at": report.created_at
-                } for report in user.company_reports]
-            } for user in channel.users]
+                "id": row.id,
+                "username": row.username,
+                "role": row.role,
+                "reports_count": row.reports_count
+            } for row in rows],
+            "total_users": total_users,
+            "page": page,
+            "page_size": page_size
         }
 
     @staticmethod
-    def get_user_reports(db: Session, user_id: int) -> List[Dict]:
-        """Get all reports for a specific user"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+    async def get_channel_user_reports(db: AsyncSession, channel_id: int, user_id: int, cursor: str = None, page_size: int = None) -> Dict:
+        """
+        Get one page of a channel user's reports, newest first, with only
+        the listing columns; report_data is never loaded
+        """
+        user_channel_id = await db.scalar(select(User.channel_id).where(User.id == user_id))
+        if user_channel_id is None or user_channel_id != channel_id:
+            raise HTTPException(status_code=404, detail="User not found in this channel")
+
+        rows = (await db.execute(keyset_page(
+            select(
+                CompanyReport.id,
+                CompanyInfo.company_name,
+                CompanyReport.report_type,
+                CompanyReport.year,
+                CompanyReport.month,
+                CompanyReport.quarter,
+                CompanyReport.created_at
+            )
+            .outerjoin(CompanyInfo, CompanyInfo.id == latest_company_info_id())
+            .where(CompanyReport.processed_by_user_id == user_id),
+            CompanyReport.created_at, CompanyReport.id, cursor, page_size
+        ))).all()
+
+        return page_envelope(rows, page_size, serialize=lambda row: dict(row._mapping))
+
+    @staticmethod
+    async def count_user_reports(db: AsyncSession, user_id: int) -> int:
+        return await db.scalar(
+            select(func.count(CompanyReport.id)).where(CompanyReport.processed_by_user_id == user_id)
+        )
+
+    @staticmethod
+    async def get_user_reports(db: AsyncSession, user_id: int, cursor: str = None, page_size: int = None) -> Dict:
+        """Get one page of the reports of a specific user, newest first"""
+        user_exists = await db.scalar(select(User.id).where(User.id == user_id))
+        if not user_exists:
             raise HTTPException(status_code=404, detail="User not found")
-        
-        return [{
+
+        reports = (await db.scalars(keyset_page(
+            select(CompanyReport)
+            .outerjoin(CompanyInfo, CompanyInfo.id == latest_company_info_id())
+            .options(contains_eager(CompanyReport.company_info))
+            .where(CompanyReport.processed_by_user_id == user_id),
+            CompanyReport.created_at, CompanyReport.id, cursor, page_size
+        ))).all()
+
+        return page_envelope(reports, page_size, serialize=lambda report: {
             "id": report.id,
-            "company_name": report.company_info.company_name,
-            "tax_number": report.company_info.tax_number,
+            "company_name": report.company_info.company_name if report.company_info else None,
+            "tax_number": report.company_tax_number,
             "report_type": report.report_type,
             "year": report.year,
             "month": report.month,
             "quarter": report.quarter,
-            "report_data": report.report_data,
             "created_at": report.created_at,
             "updated_at": report.updated_at
-        } for report in user.company_reports]
+        })
 
     @staticmethod
-    def get_report_details(db: Session, report_id: int) -> Dict:
+    async def get_report_details(db: AsyncSession, report_id: int) -> Dict:
         """Get detailed information about a specific report"""
-        report = db.query(CompanyReport).filter(CompanyReport.id == report_id).first()
+        report = await db.scalar(
+            select(CompanyReport)
+            .where(CompanyReport.id == report_id)
+            .options(
+                undefer(CompanyReport.report_data),
+                selectinload(CompanyReport.company_info),
+                selectinload(CompanyReport.processed_by_user)
+            )
+        )
         if not report:
             raise HTTPException(status_code=404, detail="Report not found")
         
@@ -1,15 +1,16 @@
 from fastapi import Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 import models
 
-async def check_top_level_admin(request: Request, db: Session = Depends(get_db)):
+async def check_top_level_admin(request: Request, db: AsyncSession = Depends(get_db)):
     """Middleware to check if user is top level admin"""
     user_id = request.session.get("user_id")
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await db.scalar(select(models.User).where(models.User.id == user_id))
     if not user or not user.is_top_level_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
     
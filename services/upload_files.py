@@ -0,0 +1,38 @@
+import os
+import shutil
+from typing import List
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from config import settings
+
+# Saving uploads to the job directory; kept apart from services/upload_jobs.py
+# so it can be used without the database and Redis clients
+
+def upload_job_dir(job_id: str) -> str:
+    return os.path.join(settings.UPLOAD_JOB_DIR, job_id)
+
+def _copy_to_disk(source, path: str):
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(source, out, settings.UPLOAD_COPY_CHUNK_SIZE)
+
+async def save_upload_files(job_id: str, files: List[UploadFile]) -> List[dict]:
+    """
+    Copy the uploaded files into the job directory and return their
+    descriptors. Each file is copied from its spooled temp file in
+    UPLOAD_COPY_CHUNK_SIZE chunks on a worker thread, so at most one chunk
+    per file is held in memory.
+    """
+    job_dir = upload_job_dir(job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    saved = []
+    for index, file in enumerate(files):
+        # Prefix with the position so duplicate names don't clash
+        path = os.path.join(job_dir, f"{index}_{os.path.basename(file.filename or 'upload')}")
+        await file.seek(0)
+        await run_in_threadpool(_copy_to_disk, file.file, path)
+        saved.append({
+            "filename": file.filename,
+            "path": path,
+            "content_type": file.content_type
+        })
+    return saved
@@ -0,0 +1,339 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+import traceback
+import uuid
+from typing import List
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from config import settings
+from database import AsyncSessionLocal
+from services.redis_client import get_redis
+from services.redis_health import redis_health
+from services.upload_files import upload_job_dir, save_upload_files
+from services.company import upload_company_info_batch
+from utils.metrics import metrics
+
+UPLOAD_JOB_KEY_PREFIX = "upload_job:"
+UPLOAD_JOB_QUEUE_KEY = "upload_job_queue"
+# Jobs taken by a worker stay in this list until they finish
+UPLOAD_JOB_PROCESSING_KEY = "upload_job_processing"
+UPLOAD_JOB_LEASE_PREFIX = "upload_job_lease:"
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+def upload_job_key(job_id: str) -> str:
+    return f"{UPLOAD_JOB_KEY_PREFIX}{job_id}"
+
+def upload_job_lease_key(job_id: str) -> str:
+    return f"{UPLOAD_JOB_LEASE_PREFIX}{job_id}"
+
+# Move a job whose lease lapsed from the processing list back to the head
+# of the queue, unless a worker took a lease or another process requeued it
+_REQUEUE_JOB_SCRIPT = """
+if redis.call('exists', KEYS[3]) == 0 and redis.call('lrem', KEYS[1], 1, ARGV[1]) == 1 then
+    redis.call('rpush', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+async def submit_upload_job(system_user_id: int, user_id: int, date_source: int, date_type: int, year: int, files: List[UploadFile]) -> str:
+    """
+    Persist the files, record the job and queue it for an upload worker.
+    Returns the job id.
+    """
+    job_id = uuid.uuid4().hex
+    try:
+        saved_files = await save_upload_files(job_id, files)
+    except OSError as e:
+        shutil.rmtree(upload_job_dir(job_id), ignore_errors=True)
+        print(f"Error saving upload files for job {job_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to store uploaded files: {str(e)}")
+
+    job = {
+        "job_id": job_id,
+        "status": QUEUED,
+        "system_user_id": str(system_user_id),
+        "user_id": str(user_id),
+        "date_source": str(date_source),
+        "date_type": str(date_type),
+        "year": str(year),
+        "files": json.dumps(saved_files),
+        "queued_at": str(time.time())
+    }
+    try:
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.hset(upload_job_key(job_id), mapping=job)
+            pipe.expire(upload_job_key(job_id), settings.UPLOAD_JOB_TTL_SECONDS)
+            pipe.lpush(UPLOAD_JOB_QUEUE_KEY, job_id)
+            await pipe.execute()
+    except Exception as e:
+        # Nothing will ever process the saved files
+        shutil.rmtree(upload_job_dir(job_id), ignore_errors=True)
+        redis_health.record_failure(e)
+        print(f"Error queueing upload job {job_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"Failed to queue upload job: {str(e)}")
+
+    metrics.inc("upload_jobs_total", result="queued")
+    print(f"Queued upload job {job_id} with {len(saved_files)} files")
+    return job_id
+
+def _timestamp(value):
+    return float(value) if value else None
+
+def _duration(start, end):
+    return round(end - start, 3) if start is not None and end is not None else None
+
+async def get_upload_job(job_id: str):
+    """
+    Job status with its timings, or None if the job is unknown or expired
+    """
+    job = await get_redis().hgetall(upload_job_key(job_id))
+    if not job:
+        return None
+
+    queued_at = _timestamp(job.get('queued_at'))
+    started_at = _timestamp(job.get('started_at'))
+    sent_at = _timestamp(job.get('sent_at'))
+    responded_at = _timestamp(job.get('responded_at'))
+    finished_at = _timestamp(job.get('finished_at'))
+    return {
+        "job_id": job_id,
+        "status": job.get('status'),
+        "user_id": int(job['user_id']),
+        "system_user_id": int(job['system_user_id']),
+        "files": [f['filename'] for f in json.loads(job.get('files') or '[]')],
+        "result": json.loads(job['result']) if job.get('result') else None,
+        "error": job.get('error') or None,
+        "error_status": int(job['error_status']) if job.get('error_status') else None,
+        "timings": {
+            "queued_at": queued_at,
+            "started_at": started_at,
+            "sent_at": sent_at,
+            "responded_at": responded_at,
+            "finished_at": finished_at,
+            "queue_wait_seconds": _duration(queued_at, started_at),
+            "upstream_seconds": _duration(sent_at, responded_at),
+            "total_seconds": _duration(queued_at, finished_at)
+        }
+    }
+
+def remove_stale_job_dirs():
+    """
+    Delete job directories older than UPLOAD_JOB_TTL_SECONDS, left behind by
+    a process that stopped between saving the files and queueing the job.
+    Their job records have expired, so no worker would ever use them.
+    """
+    cutoff = time.time() - settings.UPLOAD_JOB_TTL_SECONDS
+    try:
+        entries = list(os.scandir(settings.UPLOAD_JOB_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            print(f"Removing stale upload job directory {entry.path}")
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+class UploadJobWorkerPool:
+    """
+    Consumes the Redis upload job queue and forwards each job's files to the
+    third-party upload endpoint. Any process with Redis access can run a
+    pool; see utils/upload_worker.py for a standalone worker.
+
+    A worker moves the job it takes to a processing list and holds a lease
+    on it while it runs. Jobs left there by a worker that crashed or was
+    stopped are requeued once their lease lapses.
+    """
+
+    def __init__(self, workers: int, poll_timeout: int, lease_seconds: int, max_attempts: int):
+        self.workers = workers
+        self.poll_timeout = poll_timeout
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._tasks = []
+        self._reaper = None
+        # Jobs seen without a lease by the previous reaper run
+        self._leaseless = set()
+
+    async def process_job(self, job_id: str):
+        redis_client = get_redis()
+        key = upload_job_key(job_id)
+        job = await redis_client.hgetall(key)
+        if not job:
+            print(f"Upload job {job_id} expired before it was processed")
+            shutil.rmtree(upload_job_dir(job_id), ignore_errors=True)
+            return
+
+        attempts = await redis_client.hincrby(key, "attempts", 1)
+        if attempts > self.max_attempts:
+            print(f"Upload job {job_id} abandoned after {attempts - 1} attempts")
+            await redis_client.hset(key, mapping={
+                "status": FAILED,
+                "error": f"Upload worker stopped during each of {attempts - 1} attempts",
+                "error_status": "500",
+                "finished_at": str(time.time())
+            })
+            metrics.inc("upload_jobs_total", result="failed")
+            shutil.rmtree(upload_job_dir(job_id), ignore_errors=True)
+            return
+
+        await redis_client.hset(key, mapping={"status": RUNNING, "started_at": str(time.time())})
+        timings = {}
+        update = {}
+        db = AsyncSessionLocal()
+        handles = []
+        interrupted = False
+        try:
+            saved_files = json.loads(job['files'])
+            for saved in saved_files:
+                handles.append((saved['filename'], open(saved['path'], 'rb'), saved['content_type']))
+
+            result = await upload_company_info_batch(
+                db=db,
+                system_user_id=int(job['system_user_id']),
+                user_id=int(job['user_id']),
+                date_source=int(job['date_source']),
+                date_type=int(job['date_type']),
+                year=int(job['year']),
+                files=handles,
+                timings=timings
+            )
+            update = {"status": SUCCEEDED, "result": json.dumps(result)}
+            metrics.inc("upload_jobs_total", result="succeeded")
+        except asyncio.CancelledError:
+            # Worker stopping; the files stay for the requeued job
+            interrupted = True
+            raise
+        except HTTPException as he:
+            update = {"status": FAILED, "error": str(he.detail), "error_status": str(he.status_code)}
+            metrics.inc("upload_jobs_total", result="failed")
+        except Exception as e:
+            print(f"Upload job {job_id} failed: {str(e)}")
+            print(f"Stack trace: {traceback.format_exc()}")
+            update = {"status": FAILED, "error": str(e), "error_status": "500"}
+            metrics.inc("upload_jobs_total", result="failed")
+        finally:
+            for _, fileobj, _ in handles:
+                fileobj.close()
+            await db.close()
+            if not interrupted:
+                shutil.rmtree(upload_job_dir(job_id), ignore_errors=True)
+
+        update.update({name: str(value) for name, value in timings.items()})
+        update["finished_at"] = str(time.time())
+        await redis_client.hset(key, mapping=update)
+        print(f"Upload job {job_id} finished with status {update['status']}")
+
+    async def keep_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await get_redis().set(upload_job_lease_key(job_id), "1", ex=self.lease_seconds)
+            except Exception as e:
+                print(f"Error renewing lease of upload job {job_id}: {str(e)}")
+
+    async def run_job(self, job_id: str):
+        """
+        Process a job taken from the queue under a lease, and drop it from
+        the processing list once it finished. A job interrupted by a
+        shutdown stays there and is requeued when its lease lapses.
+        """
+        redis_client = get_redis()
+        await redis_client.set(upload_job_lease_key(job_id), "1", ex=self.lease_seconds)
+        renewal = asyncio.create_task(self.keep_lease(job_id))
+        try:
+            await self.process_job(job_id)
+        finally:
+            renewal.cancel()
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.lrem(UPLOAD_JOB_PROCESSING_KEY, 1, job_id)
+            pipe.delete(upload_job_lease_key(job_id))
+            await pipe.execute()
+
+    async def requeue_stale_jobs(self):
+        """
+        Put jobs whose lease lapsed back on the queue. A job must be seen
+        without a lease on two runs in a row, so one a worker has just
+        moved but not yet leased is left alone.
+        """
+        redis_client = get_redis()
+        job_ids = await redis_client.lrange(UPLOAD_JOB_PROCESSING_KEY, 0, -1)
+        leaseless = set()
+        if job_ids:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for job_id in job_ids:
+                    pipe.exists(upload_job_lease_key(job_id))
+                leases = await pipe.execute()
+            leaseless = {job_id for job_id, leased in zip(job_ids, leases) if not leased}
+
+        for job_id in leaseless & self._leaseless:
+            requeued = await redis_client.eval(
+                _REQUEUE_JOB_SCRIPT, 3,
+                UPLOAD_JOB_PROCESSING_KEY, UPLOAD_JOB_QUEUE_KEY, upload_job_lease_key(job_id), job_id
+            )
+            if requeued:
+                await redis_client.hset(upload_job_key(job_id), "status", QUEUED)
+                metrics.inc("upload_jobs_total", result="requeued")
+                print(f"Requeued upload job {job_id} after its worker stopped")
+        self._leaseless = leaseless
+
+    async def reap(self):
+        while True:
+            try:
+                await self.requeue_stale_jobs()
+                await run_in_threadpool(remove_stale_job_dirs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Upload job reaper error: {str(e)}")
+            await asyncio.sleep(self.lease_seconds)
+
+    async def run(self):
+        while True:
+            try:
+                job_id = await get_redis().blmove(
+                    UPLOAD_JOB_QUEUE_KEY, UPLOAD_JOB_PROCESSING_KEY, self.poll_timeout, "RIGHT", "LEFT"
+                )
+                if job_id:
+                    await self.run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Upload worker error: {str(e)}")
+                print(f"Stack trace: {traceback.format_exc()}")
+                await asyncio.sleep(1)
+
+    def start(self):
+        """
+        Start the worker tasks and the task requeueing jobs of stopped workers
+        """
+        if self._reaper is None:
+            self._tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+            self._reaper = asyncio.create_task(self.reap())
+
+    async def stop(self):
+        if self._reaper is None:
+            return
+        tasks, self._tasks = self._tasks + [self._reaper], []
+        self._reaper = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def _collect_upload_workers(registry):
+    registry.set("upload_job_workers", len(upload_job_workers._tasks))
+
+upload_job_workers = UploadJobWorkerPool(
+    workers=settings.UPLOAD_JOB_WORKERS,
+    poll_timeout=settings.UPLOAD_JOB_POLL_TIMEOUT,
+    lease_seconds=settings.UPLOAD_JOB_LEASE_SECONDS,
+    max_attempts=settings.UPLOAD_JOB_MAX_ATTEMPTS
+)
+metrics.add_collector(_collect_upload_workers)
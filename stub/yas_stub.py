@@ -0,0 +1,201 @@
+"""
+Stub of the Yi'an Tax third-party API for load and latency testing.
+
+Implements the three endpoints the services call, with the response shapes
+they parse:
+
+    POST /skServer/yas/tenantid/register
+    POST /skServer/yas/getexcel/data-impcal
+    POST /skServer/yas/risk-report/simplified/ow-data
+
+Run it and point the app at it:
+
+    uvicorn stub.yas_stub:app --port 8090 --workers 4
+    YAS_BASE_URL=http://127.0.0.1:8090/skServer/yas uvicorn main:app
+
+Behaviour per endpoint (register, upload, query) comes from environment
+variables and can be changed at runtime with PUT /_stub/config:
+
+    YAS_STUB_<ENDPOINT>_LATENCY     latency distribution in seconds:
+                                    fixed:0.2 | uniform:0.1:0.5 |
+                                    normal:0.3:0.1 | lognormal:0.3:0.5
+                                    (lognormal takes median and sigma)
+    YAS_STUB_<ENDPOINT>_ERROR_RATE  fraction of calls that fail, 0..1
+    YAS_STUB_ERROR_KINDS            comma separated failure kinds picked at
+                                    random: http500, empty, business
+    YAS_STUB_REPORT_KB              approximate size of the ow-data payload
+    YAS_STUB_TOKEN_LIFETIME         seconds until issued tokens expire
+"""
+import os
+import math
+import uuid
+import random
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+ENDPOINTS = ("register", "upload", "query")
+
+DEFAULT_LATENCY = {
+    "register": "uniform:0.05:0.2",
+    "upload": "lognormal:2:0.5",
+    "query": "lognormal:0.5:0.4"
+}
+
+RISK_LEVELS = ("high", "mid", "low", "none", "abnormal")
+
+def load_config() -> dict:
+    config = {
+        endpoint: {
+            "latency": os.getenv(f"YAS_STUB_{endpoint.upper()}_LATENCY", DEFAULT_LATENCY[endpoint]),
+            "error_rate": float(os.getenv(f"YAS_STUB_{endpoint.upper()}_ERROR_RATE", "0"))
+        }
+        for endpoint in ENDPOINTS
+    }
+    config["error_kinds"] = os.getenv("YAS_STUB_ERROR_KINDS", "http500,empty,business").split(",")
+    config["report_kb"] = int(os.getenv("YAS_STUB_REPORT_KB", "16"))
+    config["token_lifetime"] = int(os.getenv("YAS_STUB_TOKEN_LIFETIME", str(2 * 3600)))
+    return config
+
+def parse_latency(spec: str):
+    """
+    Turn a latency spec into a function returning a delay in seconds
+    """
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+config = load_config()
+samplers = {endpoint: parse_latency(config[endpoint]["latency"]) for endpoint in ENDPOINTS}
+stats = {endpoint: {"calls": 0, "errors": 0} for endpoint in ENDPOINTS}
+
+app = FastAPI(title="Yi'an Tax API stub")
+
+async def simulate(endpoint: str):
+    """
+    Sleep for a sampled latency and return an error response for a share of
+    calls, or None when the call should succeed
+    """
+    stats[endpoint]["calls"] += 1
+    await asyncio.sleep(samplers[endpoint]())
+    if random.random() >= config[endpoint]["error_rate"]:
+        return None
+
+    stats[endpoint]["errors"] += 1
+    kind = random.choice(config["error_kinds"])
+    if kind == "empty":
+        return Response(status_code=200, content=b"")
+    if kind == "business":
+        return JSONResponse({"status": 500, "msg": "系统繁忙，请稍后再试", "data": None})
+    return JSONResponse({"status": 500, "msg": "Internal Server Error"}, status_code=500)
+
+def token_error(request: Request):
+    if not request.headers.get("token"):
+        return JSONResponse({"status": 401, "msg": "token无效", "data": None})
+    return None
+
+def build_report(params: dict) -> dict:
+    """
+    ow-data payload padded with risk items up to roughly report_kb
+    """
+    seed = f"{params.get('taxpayerNo')}|{params.get('year')}|{params.get('dateTime')}"
+    rng = random.Random(seed)
+    counts = {level: rng.randint(0, 20) for level in RISK_LEVELS}
+    risk_list = []
+    size = 0
+    while size < config["report_kb"] * 1024:
+        level = rng.choice(RISK_LEVELS)
+        item = {
+            "riskCode": f"R{rng.randint(1000, 9999)}",
+            "riskName": f"指标{len(risk_list) + 1}",
+            "riskLevel": level,
+            "indicatorValue": round(rng.uniform(-100, 100), 4),
+            "thresholdValue": round(rng.uniform(0, 50), 4),
+            "description": "该指标偏离行业均值，建议关注相关涉税风险。" * 2
+        }
+        risk_list.append(item)
+        size += 250
+    return {
+        "riskMain": {
+            "taxpayerNo": params.get("taxpayerNo"),
+            "year": int(params.get("year") or 0),
+            "dateTime": int(params.get("dateTime") or 0),
+            "totalScore": rng.randint(40, 100),
+            "highRiskNum": counts["high"],
+            "midRiskNum": counts["mid"],
+            "lowRiskNum": counts["low"],
+            "noRiskNum": counts["none"],
+            "abnormalRiskNum": counts["abnormal"]
+        },
+        "riskList": risk_list
+    }
+
+@app.post("/skServer/yas/tenantid/register")
+async def register(request: Request):
+    error = await simulate("register")
+    if error:
+        return error
+    body = await request.json()
+    taxpayer_no = str(body.get("taxpayerNo") or "")
+    # Same taxpayer, same ids, like re-registering with the real API
+    digest = int(hashlib.sha1(taxpayer_no.encode()).hexdigest(), 16)
+    expiration = datetime.utcnow() + timedelta(seconds=config["token_lifetime"])
+    return {
+        "status": 200,
+        "msg": "success",
+        "data": {
+            "token": uuid.uuid4().hex,
+            "systemUserId": digest % 10 ** 8,
+            "tenantId": digest % 10 ** 6,
+            "expirationTime": expiration.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+00:00"
+        }
+    }
+
+@app.post("/skServer/yas/getexcel/data-impcal")
+async def upload(request: Request):
+    error = await simulate("upload") or token_error(request)
+    if error:
+        return error
+    form = await request.form()
+    files = form.getlist("files")
+    for file in files:
+        await file.close()
+    return {"status": 200, "msg": f"导入成功，共{len(files)}个文件", "data": None}
+
+@app.post("/skServer/yas/risk-report/simplified/ow-data")
+async def ow_data(request: Request):
+    error = await simulate("query") or token_error(request)
+    if error:
+        return error
+    params = await request.json()
+    return {"status": 200, "msg": "success", "data": build_report(params)}
+
+@app.get("/_stub/config")
+async def get_config():
+    return {"config": config, "stats": stats}
+
+@app.put("/_stub/config")
+async def update_config(request: Request):
+    """
+    Change latency, error rates or payload size of this stub process
+    """
+    changes = await request.json()
+    for endpoint in ENDPOINTS:
+        if endpoint in changes:
+            if "latency" in changes[endpoint]:
+                samplers[endpoint] = parse_latency(changes[endpoint]["latency"])
+            config[endpoint].update(changes[endpoint])
+    for key in ("error_kinds", "report_kb", "token_lifetime"):
+        if key in changes:
+            config[key] = changes[key]
+    return {"config": config}
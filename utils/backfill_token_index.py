@@ -0,0 +1,52 @@
+import sys
+import os
+import asyncio
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.redis_client import init_redis, close_redis
+from services.auth import TOKEN_KEY_PREFIX, token_index_key
+
+async def backfill_token_index():
+    """
+    Build the token -> systemUserId reverse index for token records that were
+    stored before the index existed. Each index entry gets the remaining TTL
+    of its token record.
+    """
+    redis_client = await init_redis()
+
+    indexed = 0
+    skipped = 0
+    try:
+        async for key in redis_client.scan_iter(f"{TOKEN_KEY_PREFIX}*"):
+            if await redis_client.type(key) != 'hash':
+                print(f"Skipping {key}: not a hash, run convert_token_records.py first")
+                skipped += 1
+                continue
+
+            token, system_user_id = await redis_client.hmget(key, ['token', 'systemUserId'])
+            system_user_id = system_user_id or key[len(TOKEN_KEY_PREFIX):]
+            if not token:
+                print(f"Skipping {key}: no token in record")
+                skipped += 1
+                continue
+
+            ttl = await redis_client.ttl(key)
+            if ttl == -2:
+                # Key expired between SCAN and TTL
+                skipped += 1
+                continue
+            if ttl == -1:
+                await redis_client.set(token_index_key(token), str(system_user_id))
+            else:
+                await redis_client.setex(token_index_key(token), ttl, str(system_user_id))
+            indexed += 1
+    finally:
+        await close_redis()
+
+    return indexed, skipped
+
+if __name__ == "__main__":
+    indexed, skipped = asyncio.run(backfill_token_index())
+    print(f"Indexed {indexed} tokens, skipped {skipped} keys")
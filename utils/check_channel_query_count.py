@@ -0,0 +1,102 @@
+"""
+Check that TopLevelAdminService.get_all_channels runs a constant number of
+SQL statements, however many channels, users and reports there are.
+
+Seeds a temporary SQLite database at several sizes, counts the statements
+one call issues and exits non-zero if the counts differ.
+
+    python utils/check_channel_query_count.py
+"""
+import sys
+import os
+import asyncio
+import shutil
+import tempfile
+
+# Point the app's engines at a scratch database before they are created
+directory = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'query_count.db')}"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, event
+from database import Base, engine, get_async_engine, SessionLocal, AsyncSessionLocal
+from models import Channel, User, CompanyInfo, CompanyReport
+from services.top_level_admin import TopLevelAdminService
+
+# (channels, users per channel, reports per user)
+SIZES = [(1, 1, 1), (5, 4, 3), (20, 10, 8)]
+
+def seed(channels: int, users: int, reports: int):
+    db = SessionLocal()
+    try:
+        for model in (CompanyReport, CompanyInfo, User, Channel):
+            db.execute(delete(model))
+        for c in range(channels):
+            channel = Channel(channel_number=f"C{c}", channel_name=f"Channel {c}")
+            db.add(channel)
+            db.flush()
+            for u in range(users):
+                user = User(username=f"user{c}_{u}", role="level_2", channel_id=channel.id)
+                db.add(user)
+                db.flush()
+                tax_number = f"TIN{c}_{u}"
+                db.add(CompanyInfo(company_name=f"Company {c}_{u}", tax_number=tax_number, status=True))
+                for r in range(reports):
+                    db.add(CompanyReport(
+                        processed_by_user_id=user.id,
+                        company_tax_number=tax_number,
+                        report_type="monthly",
+                        year=2024,
+                        month=r % 12 + 1,
+                        report_data={"riskList": ["x" * 100] * 10}
+                    ))
+        db.commit()
+    finally:
+        db.close()
+
+async def count_statements() -> tuple:
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async_engine = get_async_engine()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        async with AsyncSessionLocal() as db:
+            channels = await TopLevelAdminService.get_all_channels(db)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+    return len(statements), channels
+
+async def main() -> int:
+    Base.metadata.create_all(engine)
+    counts = set()
+    wrong_totals = False
+    for channels, users, reports in SIZES:
+        seed(channels, users, reports)
+        statements, result = await count_statements()
+        counts.add(statements)
+        total_reports = sum(channel["total_reports"] for channel in result)
+        print(f"{channels:3} channels x {users:3} users x {reports:3} reports: "
+              f"{statements} statements, {len(result)} channels on the page, {total_reports} reports counted")
+        if total_reports != len(result) * users * reports:
+            wrong_totals = True
+    await get_async_engine().dispose()
+    engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    if wrong_totals:
+        print("FAIL: report counts do not match the seeded data")
+        return 1
+
+    if len(counts) != 1:
+        print("FAIL: statement count depends on the data size")
+        return 1
+    print("OK: constant statement count")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,89 @@
+"""
+Check that a failing Redis does not fail ow-data report queries: the
+cross-worker lock in fetch_with_cluster_lock only saves duplicate work, so
+each Redis error must fall back to querying the third party directly and
+return the report.
+
+Replaces the lock helpers of services/company.py with ones raising
+redis.ConnectionError and exits non-zero if a scenario does not return the
+report exactly once.
+
+    python utils/check_report_lock_fallback.py
+"""
+import sys
+import os
+import asyncio
+import shutil
+import tempfile
+
+# The services import the database module; keep it off the real database
+directory = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'lock_fallback.db')}"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from services import company
+from services.redis_health import redis_health
+
+REPORT = {"status": 200, "data": {"riskMain": {}}, "cache": "miss"}
+
+async def fail(*args, **kwargs):
+    raise redis.ConnectionError("Redis went away")
+
+async def lock_held(*args, **kwargs):
+    return None
+
+async def lock_taken(*args, **kwargs):
+    return "token"
+
+class FailingRedis:
+    exists = staticmethod(fail)
+
+SCENARIOS = {
+    "acquire_lock fails": {"acquire_lock": fail},
+    "waiting on the lock fails": {"acquire_lock": lock_held, "get_redis": lambda: FailingRedis()},
+    "release_lock fails": {"acquire_lock": lock_taken, "release_lock": fail}
+}
+
+async def run(name: str, patches: dict) -> bool:
+    calls = []
+
+    async def fetch_and_store():
+        calls.append(name)
+        return REPORT
+
+    async def stored_version():
+        return None
+
+    async def load_stored(version):
+        return None
+
+    originals = {attr: getattr(company, attr) for attr in patches}
+    for attr, replacement in patches.items():
+        setattr(company, attr, replacement)
+    # Start each scenario with Redis considered healthy
+    redis_health.allow_request = lambda: True
+    try:
+        result = await company.fetch_with_cluster_lock(("TIN", name), fetch_and_store, stored_version, load_stored)
+    except Exception as e:
+        print(f"FAIL {name}: {type(e).__name__}: {str(e)}")
+        return False
+    finally:
+        for attr, original in originals.items():
+            setattr(company, attr, original)
+
+    if result is not REPORT or len(calls) != 1:
+        print(f"FAIL {name}: got {result!r} after {len(calls)} third-party calls")
+        return False
+    print(f"OK   {name}: report returned after one third-party call")
+    return True
+
+async def main() -> int:
+    results = [await run(name, patches) for name, patches in SCENARIOS.items()]
+    shutil.rmtree(directory, ignore_errors=True)
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,67 @@
+import sys
+import os
+import json
+import asyncio
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.redis_client import init_redis, close_redis
+from services.auth import (
+    TOKEN_KEY_PREFIX, REGISTRATION_KEY_PREFIX, token_index_key, to_hash_fields
+)
+
+async def convert_key(redis_client, key: str) -> bool:
+    """
+    Rewrite one legacy JSON string record as a hash, keeping its TTL.
+    Returns True if the key was converted.
+    """
+    if await redis_client.type(key) != 'string':
+        return False
+
+    raw = await redis_client.get(key)
+    ttl = await redis_client.ttl(key)
+    if raw is None or ttl == -2:
+        return False
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError:
+        print(f"Skipping {key}: stored data is not valid JSON")
+        return False
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping=to_hash_fields(data))
+        if ttl > 0:
+            pipe.expire(key, ttl)
+        if key.startswith(TOKEN_KEY_PREFIX) and data.get('token'):
+            system_user_id = data.get('systemUserId') or key[len(TOKEN_KEY_PREFIX):]
+            if ttl > 0:
+                pipe.setex(token_index_key(data['token']), ttl, str(system_user_id))
+            else:
+                pipe.set(token_index_key(data['token']), str(system_user_id))
+        await pipe.execute()
+    return True
+
+async def convert_token_records():
+    """
+    One-off conversion of yas_token:* and company_registration:* records from
+    JSON strings to hashes. Keys that are already hashes are left untouched.
+    """
+    redis_client = await init_redis()
+    converted = 0
+    skipped = 0
+    try:
+        for prefix in (TOKEN_KEY_PREFIX, REGISTRATION_KEY_PREFIX):
+            async for key in redis_client.scan_iter(f"{prefix}*"):
+                if await convert_key(redis_client, key):
+                    converted += 1
+                else:
+                    skipped += 1
+    finally:
+        await close_redis()
+    return converted, skipped
+
+if __name__ == "__main__":
+    converted, skipped = asyncio.run(convert_token_records())
+    print(f"Converted {converted} records, skipped {skipped} keys")
@@ -5,8 +5,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from models import User
-from database import engine
-from sqlalchemy.orm import sessionmaker
+from database import SessionLocal
 from utils.auth_utils import hash_password, verify_password
 import bcrypt
 import logging
@@ -18,7 +17,6 @@ logger = logging.getLogger(__name__)
 
 def create_sample_users():
     # Create a session instance
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     session = SessionLocal()
     
     try:
@@ -0,0 +1,85 @@
+import threading
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry with counters and gauges.
+    Collectors registered with add_collector() run before every snapshot,
+    which lets components publish gauges computed from their own state.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increase a counter
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set a gauge to value
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def add_collector(self, collector):
+        """
+        Register a callable invoked with this registry before each snapshot
+        """
+        self._collectors.append(collector)
+
+    def _collect(self):
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                print(f"Metrics collector error: {str(e)}")
+
+    def snapshot(self) -> dict:
+        """
+        Current values as {"counters": [...], "gauges": [...]}
+        """
+        self._collect()
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._gauges.items())
+                ]
+            }
+
+    def render_prometheus(self) -> str:
+        """
+        Current values in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for kind, samples in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            declared = set()
+            for sample in samples:
+                name = sample["name"]
+                if name not in declared:
+                    lines.append(f"# TYPE {name} {kind}")
+                    declared.add(name)
+                labels = ",".join(f'{k}="{v}"' for k, v in sample["labels"].items())
+                series = f"{name}{{{labels}}}" if labels else name
+                lines.append(f"{series} {sample['value']}")
+        return "\n".join(lines) + "\n"
+
+# Global metrics registry
+metrics = MetricsRegistry()
@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+# Items per page when the client does not ask, and the most it may ask for
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def clamp_page_size(page_size: int = None) -> int:
+    if not page_size:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+def encode_cursor(created_at: datetime, item_id: int) -> str:
+    """
+    Opaque cursor pointing after the (created_at, id) of the last item of
+    a page
+    """
+    raw = json.dumps([created_at.isoformat(), item_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_page(query, created_at_column, id_column, cursor: str = None, page_size: int = None):
+    """
+    Restrict a select to the page after `cursor`, newest first. Fetches one
+    row more than the page size so page_envelope can tell whether another
+    page follows. Rows need a non-null created_at, which the models'
+    server defaults guarantee.
+    """
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        query = query.where(or_(
+            created_at_column < created_at,
+            and_(created_at_column == created_at, id_column < item_id)
+        ))
+    return (
+        query
+        .order_by(created_at_column.desc(), id_column.desc())
+        .limit(clamp_page_size(page_size) + 1)
+    )
+
+def page_envelope(rows: list, page_size: int = None, key=None, serialize=None) -> dict:
+    """
+    {items, next_cursor, has_more} response for rows fetched by keyset_page.
+    key(row) gives the row's (created_at, id), serialize(row) its item.
+    """
+    page_size = clamp_page_size(page_size)
+    key = key or (lambda row: (row.created_at, row.id))
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return {
+        "items": [serialize(row) for row in rows] if serialize else list(rows),
+        "next_cursor": encode_cursor(*key(rows[-1])) if has_more else None,
+        "has_more": has_more
+    }
@@ -0,0 +1,41 @@
+import sys
+import os
+import json
+import asyncio
+import argparse
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from services.redis_client import init_redis, close_redis
+from services.redis_usage import collect_key_family_report, expire_keys_without_ttl
+
+async def main(args):
+    await init_redis()
+    try:
+        if args.expire_upload_params:
+            updated = await expire_keys_without_ttl("upload_params", settings.UPLOAD_PARAMS_TTL_SECONDS)
+            print(f"Set a {settings.UPLOAD_PARAMS_TTL_SECONDS}s TTL on {updated} upload_params keys")
+
+        report = await collect_key_family_report(sample_per_family=args.sample)
+    finally:
+        await close_redis()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'family':<28}{'keys':>10}{'avg bytes':>12}{'est. bytes':>14}  ttl histogram")
+    for family, stats in report["families"].items():
+        histogram = ", ".join(f"{k}={v}" for k, v in stats["ttl_histogram"].items() if v)
+        print(f"{family:<28}{stats['count']:>10}{stats['avg_bytes']:>12}{stats['estimated_total_bytes']:>14}  {histogram}")
+    print(f"\nTotal keys: {report['total_keys']}, estimated bytes: {report['estimated_total_bytes']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report Redis key counts, memory and TTLs per key family")
+    parser.add_argument("--sample", type=int, default=100, help="keys per family sampled with MEMORY USAGE")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--expire-upload-params", action="store_true",
+                        help="apply UPLOAD_PARAMS_TTL_SECONDS to upload_params keys that have no TTL")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,53 @@
+import asyncio
+
+class LeaderCancelled(Exception):
+    """
+    The caller running a shared call was cancelled, e.g. its client
+    disconnected. Waiters retry instead of failing with it.
+    """
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key within one event loop:
+    the first caller runs the coroutine, later callers await its result.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key, fn):
+        """
+        Run fn() for key unless a call for key is already in flight.
+        Returns (result, shared) where shared tells whether the result came
+        from another caller's call.
+        """
+        while key in self._inflight:
+            try:
+                return await asyncio.shield(self._inflight[key]), True
+            except LeaderCancelled:
+                # The first waiter to get here runs the call itself, the
+                # others join its call
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # Cancelling the shared future would cancel every waiter too
+            future.set_exception(LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._inflight[key]
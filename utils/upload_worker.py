@@ -0,0 +1,45 @@
+import sys
+import os
+import asyncio
+import argparse
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from services.redis_client import init_redis, close_redis
+from services.http_client import init_http_client, close_http_client
+from services.upload_jobs import UploadJobWorkerPool
+from services.spreadsheet_validation import shutdown_validation_pool
+
+async def run_workers(workers: int):
+    """
+    Run upload job workers outside the web process. They need the same
+    UPLOAD_JOB_DIR as the web process that accepted the files.
+    """
+    await init_redis()
+    await init_http_client()
+    pool = UploadJobWorkerPool(
+        workers=workers,
+        poll_timeout=settings.UPLOAD_JOB_POLL_TIMEOUT,
+        lease_seconds=settings.UPLOAD_JOB_LEASE_SECONDS,
+        max_attempts=settings.UPLOAD_JOB_MAX_ATTEMPTS
+    )
+    pool.start()
+    print(f"Running {workers} upload workers, press Ctrl+C to stop")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+        shutdown_validation_pool()
+        await close_http_client()
+        await close_redis()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process queued company info uploads")
+    parser.add_argument("--workers", type=int, default=max(settings.UPLOAD_JOB_WORKERS, 1))
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_workers(args.workers))
+    except KeyboardInterrupt:
+        pass